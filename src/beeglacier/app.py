@@ -4,12 +4,11 @@ Amazon Glacier Backups
 Icons made by Freepik" https://www.flaticon.com/authors/freepik
 """
 
+from functools import partial
 import os
 from pathlib import Path
-import threading
 import ntpath
 import json
-import tempfile
 
 import toga
 from toga.style import Pack
@@ -23,21 +22,34 @@ from .settings import (
     HEADERS_DOWNLOADS_CURRENT,
     HEADERS_JOBS,
     UPLOAD_PART_SIZE,
-    DOWNLOAD_PART_SIZE
+    UPLOAD_WORKERS,
+    UPLOAD_MEMORY_BUDGET,
+    DOWNLOAD_PART_SIZE,
+    DOWNLOAD_WORKERS,
+    ARCHIVES_PAGE_SIZE,
+    INVENTORY_FORMAT,
+    INTERACTIVE_TASK_WORKERS
 )
-from .models import get_timestamp
+from .models import db, get_timestamp
 from .models.utils import create_tables
 from .models.accounts import Account
+from .models.archives import Archive, VaultArchives
 from .models.deleted_archives import DeletedArchive
-from .models.jobs import Job
-from .models.uploads import Upload
+from .models.jobs import Job, DownloadJournal
+from .models.uploads import Upload, UploadFile, UploadJournal
 from .models.vaults import Vault
 from .components.form import Form
 from .components.table import Table
 from .utils import ObsData, Controls
 from .utils.aws import Glacier
+from .utils.inventory import format_of, iter_archives, JSON
+from .utils.partsize import AUTO as PART_SIZE_AUTO, path_size
+from .utils.retry import Interrupted
+from .utils.scheduler import get_scheduler
 from .utils.strings import TEXT
 from .utils.styles import STYLES
+from .utils import tasks
+from .utils.tasks import TaskExecutor, INTERACTIVE, BULK, FAILED
 from .models.jobs import Job
 # from .extra_impl.OptionContainer import option_enabled
 
@@ -48,14 +60,14 @@ class beeglacier(toga.App):
     glacier_instance = None
     vaults_table = None
     
-    bgtasks = list()
-
     _current_downloads = {}
 
     def _connect_glacier(self):
         aid, akey, skey, reg = Account.getaccount()
         if not self.glacier_instance:
-            self.glacier_instance = Glacier(aid, akey, skey, reg)
+            self.glacier_instance = Glacier(
+                aid, akey, skey, reg,
+                max_connections=UPLOAD_WORKERS + DOWNLOAD_WORKERS)
         return self.glacier_instance
 
     def _update_control_label(self, name, value):
@@ -70,12 +82,28 @@ class beeglacier(toga.App):
         # forcing resizing 
         control.refresh()
 
-    def _execute_bg_task(self, task, *args, **kwargs):
-        """ Execute a task in background to avoid freezing UI
+    def _execute_bg_task(self, task, *args, priority=INTERACTIVE, key=None,
+                         on_done=None, **kwargs):
+        """ Execute a task in background to avoid freezing UI. A task
+            already queued or running is not started twice
         """
-        x = threading.Thread(target=task, args=args, kwargs=kwargs)
-        self.bgtasks.append(x)
-        x.start()
+        return self.tasks.submit(task, *args, priority=priority, key=key,
+                                 on_done=on_done or self._on_bg_task_done,
+                                 **kwargs)
+
+    def _run_on_ui(self, callback):
+        """ dispatch for the executor, runs callback() on the UI loop
+        """
+        self.add_background_task(lambda app: callback())
+
+    def _on_bg_task_done(self, task):
+        if task.state == FAILED:
+            self.main_window.error_dialog('Error', str(task.error))
+
+    def _on_vaults_refreshed(self, task):
+        self._update_control_label('Vaults_TopNav_RefreshVaults', 
+                                   TEXT['BTN_REFRESH_VAULTS'])
+        self._on_bg_task_done(task)
 
     def bg_get_vaults_data(self):
         # get account info and create glacier instance
@@ -91,6 +119,8 @@ class beeglacier(toga.App):
         vaults_response = glacier.list_vaults()
         vaults = vaults_response["VaultList"]
         while vaults:
+            if tasks.cancelled():
+                return
             # insert vault to data
             for vault in vaults:
                 new_row = { key.lower():value for (key,value) in vault.items() }
@@ -113,10 +143,6 @@ class beeglacier(toga.App):
         # update table
         self.vaults_table.data = data
 
-        # refresh UI
-        self._update_control_label('Vaults_TopNav_RefreshVaults', 
-                                   TEXT['BTN_REFRESH_VAULTS'])
-
     def bg_upload_file(self, *args, **kwargs):
         """ Background task for uploading files
         """
@@ -130,9 +156,21 @@ class beeglacier(toga.App):
         glacier = self._connect_glacier()
 
         filename = ntpath.basename(path)
+        if os.path.isdir(path):
+            # directories are uploaded as a compressed tar stream
+            filename = filename + '.tar.xz'
         partsize = UPLOAD_PART_SIZE
-
+        if partsize == PART_SIZE_AUTO:
+            # resolved here: the multipart upload is created with it
+            partsize = glacier.auto_part_size(
+                path_size(path), memory_budget=UPLOAD_MEMORY_BUDGET,
+                num_workers=UPLOAD_WORKERS)
+
+        # the file as the upload starts with it, parts are read after
+        stat = None if os.path.isdir(path) else os.stat(path)
         upload_id = glacier.create_multipart_upload(vault, filename, partsize, path)
+        if stat:
+            UploadFile.remember(upload_id, stat)
 
         uploaddb = Upload.get_or_none(Upload.upload_id == upload_id)
         if not uploaddb:
@@ -143,7 +181,18 @@ class beeglacier(toga.App):
                 'filepath': path
             }).execute()
 
-        response = glacier.upload(vault, path, filename, partsize, 4, upload_id)
+        journal = None
+        if not os.path.isdir(path):
+            journal = UploadJournal(upload_id, path)
+
+        try:
+            response = glacier.upload(vault, path, filename, partsize,
+                                      UPLOAD_WORKERS, upload_id,
+                                      memory_budget=UPLOAD_MEMORY_BUDGET,
+                                      journal=journal)
+        except Interrupted:
+            # paused or aborted, its state is kept by the glacier instance
+            return
 
         update_upload = Upload.update(response = json.dumps(response)) \
                               .where(Upload.upload_id == upload_id).execute()
@@ -162,7 +211,8 @@ class beeglacier(toga.App):
             delete_vault_text = TEXT['BTN_DELETE_VAULT'] % (vaultname)
             self._update_control_label('Vaults_TopNav_DeleteVault', delete_vault_text)
             # refresh
-            self.bg_get_vaults_data()
+            self._execute_bg_task(self.bg_get_vaults_data,
+                                  on_done=self._on_vaults_refreshed)
 
     def bg_delete_archive(self, *args, **kwargs):
         if 'vaultname' not in kwargs or 'archiveid' not in kwargs: 
@@ -183,16 +233,22 @@ class beeglacier(toga.App):
                 'archiveid': archiveid,
                 'response': json.dumps(response)
             }).execute()
+            Archive.mark_deleting(vaultname, archiveid)
     
         self.refresh_option_vault_details()
 
     def bg_start_inv_job(self, vaultname):
         """ Start an inventory job and save response to db
         """
-        res = self.glacier_instance.initiate_inventory_retrieval(vaultname)
+        fmt = INVENTORY_FORMAT
+        if DeletedArchive.pending(vaultname):
+            # CSV has no InventoryDate to settle failed deletions with
+            fmt = JSON
+        job_id = self.glacier_instance.initiate_inventory_retrieval(
+            vaultname, fmt)
         jobdb = Job.insert({
                 'id': vaultname,
-                'job_id': res.id,
+                'job_id': job_id,
                 'job_type': 'inventory'
             }).execute()
         self.refresh_option_vault_details()
@@ -205,6 +261,8 @@ class beeglacier(toga.App):
                 ).order_by(Job.created_at.desc()).execute()
         
         for job in jobs:
+            if tasks.cancelled():
+                break
             job_id = job.job_id
             job_desc = self.glacier_instance.describe_job(vaultname, job_id)
             
@@ -229,13 +287,24 @@ class beeglacier(toga.App):
                     ).where(Job.job_id == job_id).execute() 
                 print (f"Job {job_id} is expired")
 
-            if job_desc['Completed'] and job_desc['StatusCode'] == 'Succeeded':
-                # donwload job output
+            if job_desc['Completed'] and job_desc['StatusCode'] == 'Succeeded' \
+               and job.job_type == 'inventory':
+                # stream the job output into the catalog, only the
+                # inventory header is kept with the job
                 r = self.glacier_instance.get_job_output(vaultname, job_id)
                 if r['status'] == 200:
-                    job_dict = json.loads(r['body'].read().decode())
+                    header = {}
+                    archives = iter_archives(r['body'],
+                                             format_of(r.get('contentType')),
+                                             header=header)
+                    changes = Archive.apply_inventory(vaultname, job_id,
+                                                      archives)
+                    confirmed, cleared = Archive.reconcile_deletions(
+                        vaultname, header.get('InventoryDate'))
+                    print (f"Inventory {job_id}: {changes}, deletions "
+                           f"confirmed {confirmed}, cleared {cleared}")
                     jobdb = Job.update(
-                            response = json.dumps(job_dict),
+                            response = json.dumps({**job_desc, **header}),
                             done = 1,
                             updated_at = get_timestamp()
                         ).where(Job.job_id == job_id).execute()
@@ -243,58 +312,72 @@ class beeglacier(toga.App):
 
         self.refresh_option_vault_details()
 
-    def bg_update_progress_uploads(self, arg2):
-        """ update progress_table """
-        data = []
+    def bg_update_progress_uploads(self, changed, arg2=None):
+        """ update progress_table and the database for the uploads
+            changed since the last call
+        """
+        current_uploads = self.glacier_instance.current_uploads
         to_remove = []
-        if self.glacier_instance.current_uploads:
-            for key, v in self.glacier_instance.current_uploads.items():
-                # TODO: Optimize this mess
+
+        # every write of this batch in one transaction, without reads
+        with db.atomic():
+            for key in changed:
+                v = current_uploads.get(key)
+                if v is None:
+                    continue
+
                 if v['status'] == 'FINISHED':
-                    parts_done = v['done']
                     # update database and remove from progress table
                     Upload.update(
                             response=v['last_response'], 
                             status=3,
-                            parts_done=parts_done) \
+                            parts_done=v['done']) \
                           .where(Upload.upload_id == key) \
                           .execute()
                     to_remove.append(key)
-                    continue
 
                 if v['status'] == 'PAUSED':
-                    uploaddb = Upload.get_or_none(Upload.upload_id == key)
-                    if uploaddb and uploaddb.parts_done != v['done']:
-                        Upload.update( 
-                            parts_done=v['done']) \
+                    Upload.update(parts_done=v['done']) \
+                          .where((Upload.upload_id == key) &
+                                 (Upload.parts_done != v['done'])) \
+                          .execute()
+
+                if v['status'] == 'ERROR':
+                    # kept resumable, the error is left in the response
+                    Upload.update(response=v['error'],
+                                  parts_done=v['done']) \
                           .where(Upload.upload_id == key) \
                           .execute()
 
                 if v['status'] == 'UPLOADING':
-                    uploaddb = Upload.get_or_none(Upload.upload_id == key)
-                    if uploaddb and uploaddb.parts != v['total_parts']:
-                        Upload.update( 
-                            parts=v['total_parts']) \
-                          .where(Upload.upload_id == key) \
+                    Upload.update(parts=v['total_parts']) \
+                          .where((Upload.upload_id == key) &
+                                 (Upload.parts != v['total_parts'])) \
                           .execute()
 
-                try:
-                    porcentage = round(v['done']/v['total_parts']*100)
-                    progress = f'{porcentage}%'
-                except:
-                    porcentage = 0
-                    progress = '0'
-
-                description = f'Uploading: {v["description"]}'
-                data.append({
-                    'vault': v['vault'],
-                    'upload_id': key,
-                    'path': v['path'],
-                    'description': description, 
-                    'progress': progress,
-                    'status': v['status']
-                })
+        data = []
+        for key, v in list(current_uploads.items()):
+            if key in to_remove or v['status'] == 'FINISHED':
+                continue
+
+            try:
+                porcentage = round(v['done']/v['total_parts']*100)
+                progress = f'{porcentage}%'
+            except:
+                porcentage = 0
+                progress = '0'
+
+            description = f'Uploading: {v["description"]}'
+            data.append({
+                'vault': v['vault'],
+                'upload_id': key,
+                'path': v['path'],
+                'description': description, 
+                'progress': progress,
+                'status': v['status']
+            })
 
+        # only new, gone or changed rows are touched
         self.progress_table.data = data
 
         # remove uploads info outside the loop
@@ -319,14 +402,23 @@ class beeglacier(toga.App):
         
         desc=ntpath.basename(path)
         try:
+            journal = None
+            if not os.path.isdir(path):
+                journal = UploadJournal(upload_id, path)
+
             response = self.glacier_instance.upload( 
                         vault=vault, 
                         path=path,
                         desc=desc,
                         part_size=UPLOAD_PART_SIZE,
-                        num_threads=4, 
-                        upload_id=upload_id
+                        num_threads=UPLOAD_WORKERS, 
+                        upload_id=upload_id,
+                        memory_budget=UPLOAD_MEMORY_BUDGET,
+                        journal=journal
             )
+        except Interrupted:
+            # paused or aborted again
+            pass
         except self.glacier_instance._get_client() \
                    .exceptions.ResourceNotFoundException:
             # Update upload to Error state and remove from currents
@@ -344,6 +436,19 @@ class beeglacier(toga.App):
     def bg_download(self, vaultname, job_id, file_path_temp, file_path_final):
         job_description = self.glacier_instance.describe_job(vaultname, job_id)
         job_selected = self.downloadjob_table.selected_row
+        journal = DownloadJournal(job_id, file_path_temp)
+        if job_description['Completed'] and job_description['StatusCode'] == 'ResourceNotFound':
+            # the job output expired, ranges already downloaded are useless
+            Job.update(
+                    response = json.dumps(job_description),
+                    error = 1,
+                    done = 1,
+                    updated_at = get_timestamp(),
+                ).where(Job.job_id == job_id).execute()
+            journal.clear()
+            print (f"Job {job_id} is expired")
+            return
+
         if job_description['Completed'] and job_description['StatusCode'] == 'Succeeded':
             
             self._current_downloads[job_id] = {
@@ -356,65 +461,45 @@ class beeglacier(toga.App):
             
             archive_checksum = job_description['ArchiveSHA256TreeHash']
             
-            done = 0
             self._current_downloads[job_id]['status'] = "Downloading"
             # size of the file
             size = job_description['ArchiveSizeInBytes']
-            #print (size)
-            # 4mb parts
-            part_size = 1024 * 1024 * DOWNLOAD_PART_SIZE
+            # range size in Mb, a resumed download keeps its ranges
+            part_size = DOWNLOAD_PART_SIZE
+            journaled_size = journal.range_size()
+            if journaled_size and journaled_size % (1024 * 1024) == 0:
+                part_size = journaled_size // (1024 * 1024)
+            elif part_size == PART_SIZE_AUTO:
+                part_size = self.glacier_instance.auto_part_size(
+                    size, max_parts=None)
+
+            def on_progress(done, parts):
+                porcentage = round(done/parts*100)
+                self._current_downloads[job_id]['progress'] = f'{porcentage}%'
+                self.launch_bg_refresh_downloads()
 
-            # amount of parts
-            parts = int(size) // part_size + 1
-            
-            # requests parts
-            for part_index in range(parts):
-                start_range= part_size * part_index
-
-                if size - part_size * part_index  < part_size:
-                    #last part
-                    end_range = size - 1
-                else:
-                    end_range = part_size * part_index + part_size - 1
-                
-                param_range = 'bytes=%s-%s' %(str(start_range),str(end_range))
-                
-                job_result = self.glacier_instance.get_job_output(vaultname, job_id, range=param_range)
-                
-                if job_result['status'] == 206:
-                    body = job_result['body'].read()
-                    response_checksum = job_result['checksum']
-                    #print(response_checksum)
-
-                    fpart = tempfile.TemporaryFile()
-                    fpart.write(body)
-                    downloaded_checksum = self.glacier_instance.calculate_tree_hash(body, part_size)
-                    fpart.close()
-                    #print(downloaded_checksum)
-                    
-                    if response_checksum==downloaded_checksum:
-                        #checksum is ok - write
-                        print(part_index)
-                        f = open(file_path_temp,'ab+')
-                        f.write(body)
-                        f.close()
-
-                        done += 1
-
-                        porcentage = round(done/parts*100)
-                        self._current_downloads[job_id]['progress'] = f'{porcentage}%'
-                        print (self._current_downloads[job_id])
+            try:
+                downloaded_checksum = self.glacier_instance.download(
+                    vaultname, job_id, file_path_temp, size, part_size,
+                    DOWNLOAD_WORKERS, on_progress, journal)
+            except Exception as e:
+                # a missing range would corrupt the file, stop here;
+                # the journal keeps the ranges written so far
+                print(f'Download error: {e!r}')
+                self._current_downloads[job_id]['status'] = 'Error'
+                self.launch_bg_refresh_downloads()
+                return
 
+            # archive checksum, combined from the verified ranges
+            if archive_checksum != downloaded_checksum:
+                journal.clear()
+                self._current_downloads[job_id]['status'] = "Checksum error"
                 self.launch_bg_refresh_downloads()
+                return
 
             os.rename(file_path_temp, file_path_final)
+            journal.clear()
             self._current_downloads[job_id]['status'] = "Downloaded"
-            # check archive checksum    
-            #downloaded_checksum = self.glacier_instance.calculate_tree_hash(open(file_path_final,'r').read(), size)
-            #print(archive_checksum)
-            #print(downloaded_checksum)
-            #if archive_checksum==downloaded_checksum:
-            #   print('ok')
             self.launch_bg_refresh_downloads()
 
     def callback_row_selected(self, row):
@@ -490,6 +575,8 @@ class beeglacier(toga.App):
         else:
             self._execute_bg_task(
                 self.bg_download, 
+                priority=BULK,
+                key=('download', job_id),
                 vaultname=vaultname, 
                 job_id=job_id,
                 file_path_temp=file_path_temp,
@@ -584,8 +671,9 @@ class beeglacier(toga.App):
         self.create_vault_dialog.show()
 
     def on_refresh_vaults(self, button, **kwargs):
-        # fetch data with threading
-        self._execute_bg_task(self.bg_get_vaults_data)
+        # fetch data in background
+        self._execute_bg_task(self.bg_get_vaults_data,
+                              on_done=self._on_vaults_refreshed)
 
     def on_upload_file(self, button):
 
@@ -601,7 +689,8 @@ class beeglacier(toga.App):
             return None
 
         if fullpath and vaultname:
-            self._execute_bg_task(self.bg_upload_file, vaultname=vaultname, fullpath=fullpath)
+            self._execute_bg_task(self.bg_upload_file, priority=BULK,
+                                  vaultname=vaultname, fullpath=fullpath)
 
     def on_set_folderpath_destination(self, button):
         folderpath = self.main_window.select_folder_dialog("Select Download Folder")
@@ -650,6 +739,9 @@ class beeglacier(toga.App):
         if 'upload_id' in selected:
             # send signal and update database
             uid = selected['upload_id']
+            # the running resume winds down with the pause, a later
+            # resume starts a new task instead of joining it
+            self.tasks.cancel(('upload', uid))
             self.glacier_instance.send_pause_upload_signal(uid)
             Upload.update(status=1).where(Upload.upload_id == uid).execute()
     
@@ -658,6 +750,8 @@ class beeglacier(toga.App):
         if 'upload_id' in selected: 
             self._execute_bg_task(
                 self.bg_resume_upload,
+                priority=BULK,
+                key=('upload', selected['upload_id']),
                 vault=selected['vault'], 
                 path=selected['path'],
                 upload_id=selected['upload_id']
@@ -666,6 +760,7 @@ class beeglacier(toga.App):
     def on_abort_upload(self, button):
         selected = self.progress_table.selected_row
         if 'upload_id' in selected: 
+            self.tasks.cancel(('upload', selected['upload_id']))
             self._execute_bg_task(
                 self.bg_abort_upload, 
                 vaultname=selected['vault'], 
@@ -707,14 +802,6 @@ class beeglacier(toga.App):
                     (Job.job_type == 'inventory')
                   ).order_by(Job.created_at.desc()).execute()
 
-        # retrieve deleted archives to show info that's
-        # is in process of deletion if it's present in 
-        # last vault job detail
-        deleted_archives = DeletedArchive.select(DeletedArchive.archiveid) \
-                                         .where(DeletedArchive.vaultname == selected_vault_name) \
-                                         .execute()
-        deleted_ids = [delar.archiveid for delar in deleted_archives]
-
         text_pend_jobs = f'{TEXT["PENDING_INVENTORY_JOBS"]} {len(jobs)}'
         self.vault_pending_jobs.text = text_pend_jobs
         if len(jobs):
@@ -723,31 +810,36 @@ class beeglacier(toga.App):
             btn_start_inv_job.enabled = True
         btn_check_inv_job.enabled = not btn_start_inv_job.enabled
 
+        total = Archive.count_vault(selected_vault_name)
+        if not total:
+            total = self.backfill_archives(selected_vault_name)
+
+        # the table fetches the pages of the catalog it shows, deletions
+        # are flagged in the rows
+        self.archives_table.provider = VaultArchives(selected_vault_name,
+                                                     ARCHIVES_PAGE_SIZE)
+        self.archives_count_label.text = TEXT['LABEL_ARCHIVES_COUNT'] % total
+
+    def backfill_archives(self, vaultname):
+        """ Fill the catalog of a vault from the last inventory stored
+            as json by older versions, returns the number of archives
+        """
         done_jobs = Job.select().where(
-                    (Job.id == selected_vault_name) &
+                    (Job.id == vaultname) &
                     (Job.done == 1) &
                     (Job.error == 0) &
-                    (Job.job_type == 'inventory')
-                  ).order_by(Job.created_at.desc()).execute()
-        
-        print(len(done_jobs))
-        if len(done_jobs):
-            last_job_done = json.loads(done_jobs[0].response)
-            list_archives = last_job_done['ArchiveList']
-            data = []
-            for archive in list_archives:
-                new_row = { key.lower():value for (key,value) in archive.items() }
-                new_row['size'] = round(new_row['size']/1024/1024,2)
-                new_row['deletion_in_progress'] = ''
-                
-                if archive['ArchiveId'] in deleted_ids:
-                    new_row['deletion_in_progress'] = 'Yes'
-
-                data.append(new_row)
-            
-            self.archives_table.data = data
-        else:
-            self.archives_table.data = []
+                    (Job.job_type == 'inventory') &
+                    (Job.response.is_null(False))
+                  ).order_by(Job.created_at.desc()).limit(1).execute()
+        if not len(done_jobs):
+            return 0
+
+        last_job_done = json.loads(done_jobs[0].response)
+        if 'ArchiveList' not in last_job_done:
+            return 0
+        Archive.apply_inventory(vaultname, done_jobs[0].job_id,
+                                last_job_done['ArchiveList'])
+        return Archive.count_vault(vaultname)
 
     def refresh_current_downloads(self, arg2):
         data = []
@@ -755,40 +847,39 @@ class beeglacier(toga.App):
         for key, value in self._current_downloads.items():
             new_row = { 'job_id': key, **value }
             data.append(new_row)
-    
-        print (data)
+
         self.current_downloads_table.data = data
 
     def create_controls(self):
 
         # Vaults: Box
         self.app_box = toga.Box(style=Pack(direction=COLUMN, flex=1, padding=10))
-        global_controls.add('Vaults', self.app_box.id)
+        global_controls.register('Vaults', self.app_box)
 
         # Vaults -> Top Nav: Box
         self.nav_box = toga.Box(style=Pack(direction=ROW, flex=1, alignment="top"))
         self.app_box.add(self.nav_box)
-        global_controls.add('Vaults_TopNav', self.nav_box.id)
+        global_controls.register('Vaults_TopNav', self.nav_box)
 
         # Vaults -> Top Nav -> RefreshVautls: Button
         self.refresh_vaults_button = toga.Button(TEXT['BTN_REFRESH_VAULTS'], on_press=self.on_refresh_vaults)
         self.nav_box.add(self.refresh_vaults_button)
-        global_controls.add('Vaults_TopNav_RefreshVaults', self.refresh_vaults_button.id)
+        global_controls.register('Vaults_TopNav_RefreshVaults', self.refresh_vaults_button)
 
         # Vaults -> Top Nav -> CreateVault: Button
         create_vault_button = toga.Button('New Vault', on_press=self.on_create_vault)
         self.nav_box.add(create_vault_button)
-        global_controls.add('Vaults_TopNav_NewVault', create_vault_button.id)
+        global_controls.register('Vaults_TopNav_NewVault', create_vault_button)
 
         # Vaults -> Top Nav -> DeleteVault: Button
         delete_vault_btn = toga.Button('Delete Vault', enabled=False, on_press=self.on_delete_vault)
-        global_controls.add('Vaults_TopNav_DeleteVault', delete_vault_btn.id)
+        global_controls.register('Vaults_TopNav_DeleteVault', delete_vault_btn)
         self.nav_box.add(delete_vault_btn)
 
         # Vautls -> TableContainer: Box
         list_box = toga.Box(style=Pack(direction=COLUMN, flex=1, padding_top=5, alignment="top"))
         self.app_box.add(list_box)
-        global_controls.add('Vaults_TableContainer', list_box.id)
+        global_controls.register('Vaults_TableContainer', list_box)
 
         # Vautls -> TableContainer -> VaultsTable: Table
         self.vaults_table = Table(headers=HEADERS)
@@ -799,55 +890,55 @@ class beeglacier(toga.App):
         # Vaults -> Upload: Box
         add_file_box = toga.Box(style=Pack(direction=COLUMN, flex=1, padding_top=20))
         self.app_box.add(add_file_box)
-        global_controls.add('Vaults_Upload', add_file_box.id)
+        global_controls.register('Vaults_Upload', add_file_box)
 
         # Vaults -> Upload -> Title: Box
         upload_vault_title_box = toga.Box(style=Pack(direction=COLUMN, flex=1))
         add_file_box.add(upload_vault_title_box)
-        global_controls.add('Vaults_Upload_Title', upload_vault_title_box.id)
+        global_controls.register('Vaults_Upload_Title', upload_vault_title_box)
 
         # Vaults -> Upload -> VaultName: Label
         upload_label = TEXT['LABEL_UPLOAD_VAULT'] % ('-')
         label_upload_vaultname = toga.Label(upload_label,style=STYLES['TITLE'])
         upload_vault_title_box.add(label_upload_vaultname)
-        global_controls.add('Vaults_Upload_VaultName', label_upload_vaultname.id)
+        global_controls.register('Vaults_Upload_VaultName', label_upload_vaultname)
 
         # Vaults -> Upload -> InputFileBox
         input_file_box = toga.Box(style=Pack(direction=ROW, flex=1, padding_top=5))
         add_file_box.add(input_file_box)
-        global_controls.add('Vaults_Upload_InputFileBox', input_file_box.id)
+        global_controls.register('Vaults_Upload_InputFileBox', input_file_box)
 
         # Vaults -> Upload -> VaultPath: TextInput
         self.input_path = toga.TextInput(readonly=True, style=Pack(flex=2))
         self.input_path.value = ''
         input_file_box.add(self.input_path)
-        global_controls.add('Vaults_Upload_VaultPath', self.input_path.id)
+        global_controls.register('Vaults_Upload_VaultPath', self.input_path)
         
         # Vaults -> Upload -> SearchFile: Button
         searchfile_upload = toga.Button('Browse', on_press=self.on_searchfile_btn, 
                                         style=Pack(padding_left=5, flex=1))
         input_file_box.add(searchfile_upload)
-        global_controls.add('Vaults_Upload_SearchFileBtn', searchfile_upload.id)
+        global_controls.register('Vaults_Upload_SearchFileBtn', searchfile_upload)
 
         # Vaults -> Upload -> Button: Button
         self.button_upload = toga.Button('Upload', on_press=self.on_upload_file, 
                                          style=Pack(padding_top=10, width=100,alignment='right'))
         add_file_box.add(self.button_upload)
-        global_controls.add('Vaults_Upload_Button', self.button_upload.id)
+        global_controls.register('Vaults_Upload_Button', self.button_upload)
 
         # VaultDetail: Box
         self.vault_box = toga.Box(style=Pack(direction=COLUMN, flex=1, padding=10))
-        global_controls.add('VaultDetail', self.vault_box.id)
+        global_controls.register('VaultDetail', self.vault_box)
 
         # VaultDetail -> VaultTitle: Label
         self.vault_title = toga.Label('Vault selected: -', style=Pack(font_size=16, padding_bottom=5))
         self.vault_box.add(self.vault_title)
-        global_controls.add('VaultDetail_VaultTitle', self.vault_title.id)
+        global_controls.register('VaultDetail_VaultTitle', self.vault_title)
 
         # VaultDetail -> VaultPendingJobs: Label
         self.vault_pending_jobs = toga.Label('%s 0' % (TEXT['PENDING_INVENTORY_JOBS']))
         self.vault_box.add(self.vault_pending_jobs)
-        global_controls.add('VaultDetail_VaultPendingJobs', self.vault_pending_jobs.id)
+        global_controls.register('VaultDetail_VaultPendingJobs', self.vault_pending_jobs)
 
         # VaultDetail -> ArchivesTable: Table
         self.archives_table = Table(headers=HEADERS_ARCHIVES)
@@ -855,54 +946,60 @@ class beeglacier(toga.App):
         self.vault_box.add(self.archives_table.getbox())
         global_controls.add_from_controls(self.archives_table.getcontrols(),'VaultDetail_TableContainer_')
 
+        # VaultDetail -> ArchivesCount: Label
+        self.archives_count_label = toga.Label(TEXT['LABEL_ARCHIVES_COUNT'] % 0,
+                                               style=Pack(padding_top=5))
+        self.vault_box.add(self.archives_count_label)
+        global_controls.register('VaultDetail_ArchivesCount', self.archives_count_label)
+
         # VaultDetail -> BottomNav: Box
         self.bottom_nav_vault = toga.Box(style=Pack(direction=ROW, flex=1, padding_top=5))
         self.vault_box.add(self.bottom_nav_vault)
-        global_controls.add('Vaults_BottomNavVault', self.bottom_nav_vault.id)
+        global_controls.register('Vaults_BottomNavVault', self.bottom_nav_vault)
 
         # VaultDetail -> StartInventoryJobButton: Button
         btn_start_inv_job = toga.Button(TEXT['BTN_START_INV_JOB'], 
                                         on_press=self.on_btn_start_inv_job,
                                         enabled=False)
         self.bottom_nav_vault.add(btn_start_inv_job)
-        global_controls.add('VaultDetail_StartInventoryJobButton', 
-                            btn_start_inv_job.id)
+        global_controls.register('VaultDetail_StartInventoryJobButton', 
+                            btn_start_inv_job)
 
         # VaultDetail -> CheckJobsButton: Button
         self.btn_check_jobs = toga.Button('Check Jobs', on_press=self.on_btn_check_jobs)
         self.bottom_nav_vault.add(self.btn_check_jobs)
-        global_controls.add('VaultDetail_CheckJobsButton', self.btn_check_jobs.id)
+        global_controls.register('VaultDetail_CheckJobsButton', self.btn_check_jobs)
 
         # VaultDetail -> ArchiveBox: Box
         self.archive_selected_box = toga.Box(style=Pack(direction=COLUMN, flex=1, padding_top=15))
         self.vault_box.add(self.archive_selected_box)
-        global_controls.add('Vaults_ArchiveBox', self.archive_selected_box.id)
+        global_controls.register('Vaults_ArchiveBox', self.archive_selected_box)
         self.archive_selected_box._impl.set_hidden(False)
 
         # VaultDetail -> VaultTitle: Label
         self.archive_title = toga.Label('Archive selected: -', style=Pack(font_size=16, padding_bottom=1))
         self.archive_selected_box.add(self.archive_title)
-        global_controls.add('VaultDetail_ArchiveTitle', self.archive_title.id)
+        global_controls.register('VaultDetail_ArchiveTitle', self.archive_title)
 
         # VaultDetail -> PendingDownload: Label
         vault_pending_archive_down = toga.Label('%s 0' % (TEXT['PENDING_ARCHIVE_JOBS']))
         self.archive_selected_box.add(vault_pending_archive_down)
-        global_controls.add('VaultDetail_PendingDownload', vault_pending_archive_down.id)
+        global_controls.register('VaultDetail_PendingDownload', vault_pending_archive_down)
 
         # VaultDetail -> ArchiveDownloadBox: Box
         self.archive_download_box = toga.Box(style=Pack(direction=ROW, flex=1, padding_top=4))
         self.archive_selected_box.add(self.archive_download_box)
-        global_controls.add('Vaults_ArchiveDownloadBox', self.archive_download_box.id)
+        global_controls.register('Vaults_ArchiveDownloadBox', self.archive_download_box)
 
         # VaultDetail -> StartDownloadArchiveJobButton: Button
         self.btn_request_download_job = toga.Button('Start Download Archive Job', on_press=self.on_btn_request_download_job)
         self.archive_download_box.add(self.btn_request_download_job)
-        global_controls.add('VaultDetail_StartDownloadArchiveJobButton', self.btn_request_download_job.id)
+        global_controls.register('VaultDetail_StartDownloadArchiveJobButton', self.btn_request_download_job)
 
         # VaultDetail_DeleteArchive: Button
         self.btn_delete_archive = toga.Button('Delete', enabled=False, on_press=self.on_delete_archive)
         self.archive_download_box.add(self.btn_delete_archive)
-        global_controls.add('VaultDetail_DeleteArchive', self.btn_delete_archive.id)
+        global_controls.register('VaultDetail_DeleteArchive', self.btn_delete_archive)
 
         # credentials
         fields = [
@@ -935,10 +1032,10 @@ class beeglacier(toga.App):
 
         # OnProgress: Box
         self.onprogress_box = toga.Box(style=STYLES['OPTION_BOX'])
-        global_controls.add('OnProgress', self.onprogress_box.id)
+        global_controls.register('OnProgress', self.onprogress_box)
         
         # OnProgress > OnProgressTable: Table
-        self.progress_table = Table(headers=HEADERS_ON_PROGRESS)
+        self.progress_table = Table(headers=HEADERS_ON_PROGRESS, key='upload_id')
         #self.progress_table.subscribe('on_select_row', self.callback_row_selected)
         self.onprogress_box.add(self.progress_table.getbox())
         global_controls.add_from_controls(self.progress_table.getcontrols(),'OnProgress_TableContainer_')
@@ -946,17 +1043,17 @@ class beeglacier(toga.App):
         # OnProgress_PauseUpload: Button
         self.btn_pause_upload = toga.Button('Pause', on_press=self.on_pause_upload)
         self.onprogress_box.add(self.btn_pause_upload)
-        global_controls.add('OnProgress_PauseUpload', self.btn_pause_upload.id)
+        global_controls.register('OnProgress_PauseUpload', self.btn_pause_upload)
 
         # OnProgress_ResumeUpload: Button
         self.btn_resume_upload = toga.Button('Resume', on_press=self.on_resume_upload)
         self.onprogress_box.add(self.btn_resume_upload)
-        global_controls.add('OnProgress_ResumeUpload', self.btn_resume_upload.id)
+        global_controls.register('OnProgress_ResumeUpload', self.btn_resume_upload)
 
         # OnProgress_AbortUpload: Button
         self.btn_abort_upload = toga.Button('Abort', on_press=self.on_abort_upload)
         self.onprogress_box.add(self.btn_abort_upload)
-        global_controls.add('OnProgress_AbortUpload', self.btn_abort_upload.id)
+        global_controls.register('OnProgress_AbortUpload', self.btn_abort_upload)
 
         # DownloadBox
         # -- downloadjob_table
@@ -970,47 +1067,48 @@ class beeglacier(toga.App):
 
         # DownloadBox: Box (Inside Option Download)
         self.downloads_box = toga.Box(style=STYLES['OPTION_BOX'])
-        global_controls.add('DownloadBox', self.downloads_box.id)
+        global_controls.register('DownloadBox', self.downloads_box)
 
         # DownloadBox > TableJobs
-        self.downloadjob_table = Table(headers=HEADERS_DOWNLOADS_JOBS, height=200)
+        self.downloadjob_table = Table(headers=HEADERS_DOWNLOADS_JOBS, height=200, key='job_id')
         self.downloads_box.add(self.downloadjob_table.getbox())
         global_controls.add_from_controls(self.downloadjob_table.getcontrols(),'DownloadBox_TableJobs_')
 
         # DownloadButtonsBox
         self.downloads_buttons_box = toga.Box(style=Pack(direction=ROW, padding_top=5))
-        global_controls.add('DownloadButtonsBox', self.downloads_buttons_box.id)
+        global_controls.register('DownloadButtonsBox', self.downloads_buttons_box)
 
         # DownloadButtonsBox: Download Archive
         self.btn_download_rom_job = toga.Button('Download archive from Job', on_press=self.on_download_archive_from_job)
         self.downloads_buttons_box.add(self.btn_download_rom_job)
-        global_controls.add('DownloadBox_BtnDownload', self.btn_download_rom_job.id)
+        global_controls.register('DownloadBox_BtnDownload', self.btn_download_rom_job)
 
         # DownloadButtonsBox: Delete Job
         self.btn_mark_job_as_done = toga.Button('Mark job as done', on_press=self.on_mark_as_done)
         self.downloads_buttons_box.add(self.btn_mark_job_as_done)
-        global_controls.add('DownloadBox_BtnMarkAsDone', self.btn_mark_job_as_done.id)
+        global_controls.register('DownloadBox_BtnMarkAsDone', self.btn_mark_job_as_done)
 
          # DownloadFolderBox
         self.downloads_folder_box = toga.Box(style=Pack(direction=ROW, padding_top=5))
-        global_controls.add('DownloadFolderBox', self.downloads_folder_box.id)
+        global_controls.register('DownloadFolderBox', self.downloads_folder_box)
 
         # Vaults_Download_Folder: TextInput
         self.folder_path = toga.TextInput(readonly=True, style=Pack(flex=2))
         self.folder_path.value = ''
         self.downloads_folder_box.add(self.folder_path)
-        global_controls.add('Vaults_Download_Folder', self.folder_path.id)
+        global_controls.register('Vaults_Download_Folder', self.folder_path)
 
         # Button for open select folder dialog
         self.btn_dialog_select_folder = toga.Button('...', on_press=self.on_set_folderpath_destination)
         self.downloads_folder_box.add(self.btn_dialog_select_folder)
-        global_controls.add('DownloadBox_BtnOpenDialogSelectFolder', self.btn_dialog_select_folder.id)
+        global_controls.register('DownloadBox_BtnOpenDialogSelectFolder', self.btn_dialog_select_folder)
 
         self.downloads_box.add(self.downloads_buttons_box)
         self.downloads_box.add(self.downloads_folder_box)
 
         # DownloadBox > TableCurrent
-        self.current_downloads_table = Table(headers=HEADERS_DOWNLOADS_CURRENT, height=175)
+        self.current_downloads_table = Table(headers=HEADERS_DOWNLOADS_CURRENT, height=175,
+                                             key='job_id')
         self.downloads_box.add(self.current_downloads_table.getbox())
         global_controls.add_from_controls(self.current_downloads_table.getcontrols(),'DownloadBox_TableCurrent_')
 
@@ -1028,20 +1126,24 @@ class beeglacier(toga.App):
         # disable vaults detail option
         #option_enabled(self.container, 1, False)
 
-        global_controls.add('Main_OptionContainer', self.container.id)
+        global_controls.register('Main_OptionContainer', self.container)
         
-    def launch_bg_update_onprogress(self):
+    def launch_bg_update_onprogress(self, changed):
         """ launch a bg task for refresh UI. This is called by an
-            observable inside Glacier Instance. Every time "current_uploads"
-            change, this task is called
+            observable inside Glacier Instance, at most a few times per
+            second with the uploads changed in between
         """
-        self.add_background_task(self.bg_update_progress_uploads)
+        self.add_background_task(
+            partial(self.bg_update_progress_uploads, changed))
     
     def launch_bg_refresh_downloads(self):
         self.add_background_task(self.refresh_current_downloads)
     
     def setup_glacier(self):
         self.account = Account.getaccount(object)
+
+        # one pool of part workers shared by every upload
+        get_scheduler().resize(UPLOAD_WORKERS)
         
         if not self.account:
             return False
@@ -1050,7 +1152,8 @@ class beeglacier(toga.App):
                 self.account.account_id, 
                 self.account.access_key,
                 self.account.secret_key, 
-                self.account.region_name
+                self.account.region_name,
+                max_connections=UPLOAD_WORKERS + DOWNLOAD_WORKERS
             )
 
             # register an observable for current uploads status change
@@ -1067,6 +1170,10 @@ class beeglacier(toga.App):
         return return_val
 
     def startup(self): 
+        # background tasks, done callbacks run on the UI loop
+        self.tasks = TaskExecutor(INTERACTIVE_TASK_WORKERS,
+                                  dispatch=self._run_on_ui)
+
         # setup
         account_exists = self.pre_init()
 
@@ -1076,7 +1183,7 @@ class beeglacier(toga.App):
 
         # Main: Box
         self.main_box = toga.Box(style=Pack(direction=COLUMN, flex=1))
-        global_controls.add('Main', self.main_box.id)
+        global_controls.register('Main', self.main_box)
 
         # Create all controls
         self.create_controls()
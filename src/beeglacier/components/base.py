@@ -11,7 +11,7 @@ class Base:
     def __init__(self, **kwargs):
         self.__controls = Controls()
         self.basebox = toga.Box(style=Pack(direction=COLUMN, flex=1, padding=5))
-        self.getcontrols().add('BaseBox', self.basebox.id)
+        self.getcontrols().register('BaseBox', self.basebox)
 
     def getbox(self):
         return self.basebox
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+
+from toga.sources import Source, Row
+
+# Virtual data source for toga tables.
+#
+# The cocoa backend asks the source for its length and then for the
+# rows it is about to draw, by index. PagedSource answers those from a
+# provider, one page at a time, so only the pages around the visible
+# window are ever loaded, and more are fetched as the user scrolls.
+# The gtk and winforms tables copy every row of their source into a
+# model of their own instead, so they are given all the rows at once
+# (fetch_all) and PagedSource is only used on cocoa.
+#
+# A provider is any object with:
+#   count()                 -> number of rows
+#   fetch(page, page_size)  -> list of row dicts of that page (from 1)
+#   key(row)                -> stable id of a row dict (optional)
+#   page_size               -> rows per fetch (optional)
+
+PAGE_SIZE = 200
+MAX_PAGES = 10  # pages kept in memory
+
+
+def fetch_all(provider, page_size=PAGE_SIZE):
+    """ every row of a provider, a page at a time
+    """
+    rows = []
+    page = 1
+    while True:
+        fetched = provider.fetch(page, page_size)
+        rows.extend(fetched)
+        if len(fetched) < page_size:
+            return rows
+        page += 1
+
+
+class PagedSource(Source):
+
+    def __init__(self, accessors, provider, page_size=PAGE_SIZE,
+                 max_pages=MAX_PAGES):
+        super().__init__()
+        self._accessors = accessors
+        self.provider = provider
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._count = None
+        self._pages = OrderedDict()   # page -> [Row], least recent first
+        self._by_id = {}              # row id -> row dict, loaded pages
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.provider.count()
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        page = index // self.page_size + 1
+        rows = self._load(page)
+        offset = index % self.page_size
+        if offset >= len(rows):
+            # the backing data shrank since it was counted
+            raise IndexError(index)
+        return rows[offset]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def index(self, row):
+        return getattr(row, '_index')
+
+    def _row_id(self, data, index):
+        key = getattr(self.provider, 'key', None)
+        return key(data) if key else index
+
+    def _load(self, page):
+        if page in self._pages:
+            self._pages.move_to_end(page)
+            return self._pages[page]
+
+        first = (page - 1) * self.page_size
+        rows = []
+        for offset, data in enumerate(self.provider.fetch(page,
+                                                          self.page_size)):
+            row_id = self._row_id(data, first + offset)
+            data['___id'] = row_id
+            row = Row(**{name: data.get(name) for name in self._accessors})
+            row._source = self
+            row._index = first + offset
+            setattr(row, '___id', row_id)
+            data['_row'] = row
+            self._by_id[row_id] = data
+            rows.append(row)
+
+        self._pages[page] = rows
+        while len(self._pages) > self.max_pages:
+            _, evicted = self._pages.popitem(last=False)
+            for row in evicted:
+                self._by_id.pop(getattr(row, '___id'), None)
+        return rows
+
+    def get(self, row_id):
+        """ row dict of a loaded row, by id
+        """
+        return self._by_id.get(row_id)
+
+    def reload(self):
+        """ forget loaded pages and the count, rows are fetched again
+            when the table draws them
+        """
+        self._count = None
+        self._pages.clear()
+        self._by_id.clear()
+        self._notify('refresh')
@@ -51,8 +51,8 @@ class Form(Base):
                 # create controls
                 label_control = toga.Label(label, style=field_style)
                 input_control = toga.TextInput(placeholder='',style=field_style)
-                self.getcontrols().add('FormContainer_Label' + name.capitalize() + '', label_control.id)
-                self.getcontrols().add('FormContainer_Input' + name.capitalize() + '', input_control.id)
+                self.getcontrols().register('FormContainer_Label' + name.capitalize() + '', label_control)
+                self.getcontrols().register('FormContainer_Input' + name.capitalize() + '', input_control)
 
                 # add to box
                 self.fields[name] = { 'label': label_control, 'input': input_control}
@@ -66,7 +66,7 @@ class Form(Base):
             self.confirm_btn = toga.Button(label, 
                                            on_press=self._process_callback,
                                            style=confirm_style)
-            self.getcontrols().add('FormContainer_ConfirmButton', self.confirm_btn.id)
+            self.getcontrols().register('FormContainer_ConfirmButton', self.confirm_btn)
             self.basebox.add(self.confirm_btn)
 
         if 'initial' in kwargs:
@@ -2,6 +2,7 @@ import toga
 from toga.style import Pack
 from toga.style.pack import COLUMN, ROW
 from .base import Base
+from .datasource import PagedSource, PAGE_SIZE, fetch_all
 
 # Relashionship between toga row and _data row.
 
@@ -25,6 +26,20 @@ class Table(Base):
         self._data = []
         self._observers_data_change = []
 
+        # rows by ___id, and the next id to give
+        self._by_id = {}
+        self._next_id = 0
+
+        # provider of the rows, and its virtual source where the
+        # backend supports it
+        self._provider = None
+        self._source = None
+
+        # name of the column that identifies a row (key=...), rows are
+        # then updated in place by key instead of rebuilt
+        self._key = kwargs.get('key')
+        self._by_key = {}
+
         if 'headers' in kwargs.keys():
             # set headers. Ex.:
             # [
@@ -44,7 +59,7 @@ class Table(Base):
                                        style=table_style, 
                                        on_select=self._on_row_selected,
                                        accessors=self._get_header_names())
-        self.getcontrols().add('Table', self._toga_table.id)
+        self.getcontrols().register('Table', self._toga_table)
         self.basebox.add(self._toga_table)
 
     def _filter_columns(self, row):
@@ -81,44 +96,151 @@ class Table(Base):
         #   {'vaultname': 'test 2', 'numberofarchives': '4', 'sizeinbytes': '60.45' }
         # ]
         
+        if self._key and self._source is None and self._apply_diff(value):
+            for callback in self._observers_data_change:
+                callback(self._data)
+            return
+
         #remove exsiting data
+        self._source = None
+        self._provider = None
+        self._by_id = {}
+        self._by_key = {}
+        self._next_id = 0
         self._toga_table.data = []
 
         self._data = value
-        
-        index = 0
+
         for row in self._data:
-            self._append_wrapper(row, index)
-            index += 1
+            self._append_wrapper(row, self._new_id())
 
         for callback in self._observers_data_change:
             callback(self._data)
 
         self.refresh()
+
+    def _apply_diff(self, value):
+        """ change the shown rows into value with the fewest row
+            operations: rows whose key is gone are removed, new keys
+            inserted and the others only get their changed cells set.
+            False (nothing done) when the kept rows changed order.
+        """
+        new_keys = [row[self._key] for row in value]
+        new_set = set(new_keys)
+        if len(new_set) != len(new_keys):
+            return False
+        kept = [row[self._key] for row in self._data if row[self._key] in new_set]
+        if kept != [key for key in new_keys if key in self._by_key]:
+            return False
+
+        for row in self._data:
+            if row[self._key] not in new_set:
+                self._drop(row)
+
+        self._data = []
+        for position, row in enumerate(value):
+            existing = self._by_key.get(row[self._key])
+            if existing is None:
+                self._append_wrapper(row, self._new_id(), position)
+                existing = row
+            else:
+                self._set_cells(existing, row)
+            self._data.append(existing)
+        return True
+
+    def _set_cells(self, existing, values):
+        """ update the row dict, touching only the cells that changed
+        """
+        shown = self._get_header_names()
+        for name, value in values.items():
+            if name in ('___id', '_row') or existing.get(name) == value:
+                continue
+            existing[name] = value
+            if name in shown:
+                setattr(existing['_row'], name, value)
+
+    def _drop(self, row):
+        if self._selected_row is row:
+            self.selected_row = None
+        self._toga_table.data.remove(row['_row'])
+        self._by_id.pop(row['___id'], None)
+        if self._key:
+            self._by_key.pop(row[self._key], None)
     
-    def _append_wrapper(self, row, index):
-        """ append wrapper used by data property and append method
+    def _is_virtual(self):
+        """ only the cocoa table reads rows from its source as it draws
+            them, gtk and winforms copy the whole source when it is set
+        """
+        return type(self._toga_table._impl).__module__ \
+                   .startswith('toga_cocoa')
+
+    @property
+    def provider(self):
+        return self._provider
+
+    @provider.setter
+    def provider(self, provider):
+        """ Show rows from a provider (see datasource). On cocoa only the
+            pages the table draws are fetched, other backends get every
+            row
+        """
+        page_size = getattr(provider, 'page_size', PAGE_SIZE)
+        if not self._is_virtual():
+            self.data = fetch_all(provider, page_size)
+            self._provider = provider
+            return
+
+        self._provider = provider
+        self._data = []
+        self._by_id = {}
+        self._by_key = {}
+        self._source = PagedSource(self._get_header_names(), provider,
+                                   page_size)
+        self._toga_table.data = self._source
+
+        for callback in self._observers_data_change:
+            callback(self._data)
+
+        self.refresh()
+
+    def reload(self):
+        """ Fetch the rows of the provider again
+        """
+        if self._source:
+            self._source.reload()
+        elif self._provider:
+            self.provider = self._provider
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _append_wrapper(self, row, index, position=None):
+        """ append wrapper used by data property and append method,
+            or insert at position
         """
         #filter columns
         filtered_row = self._filter_columns(row)
 
         # add row to table
-        row_added = self._toga_table.data.append(*filtered_row)
+        if position is None:
+            row_added = self._toga_table.data.append(*filtered_row)
+        else:
+            row_added = self._toga_table.data.insert(position, *filtered_row)
         
         # set ids
         setattr(row_added, '___id', index)
         row['___id'] = index
+        self._by_id[index] = row
+        if self._key:
+            self._by_key[row[self._key]] = row
 
         # add object row to self._data (row)
         row['_row'] = row_added
 
     def append(self, newrow):
         
-        # get max index
-        index = 0
-        indexes = [ x['___id'] for x in self._data ]
-        if indexes:
-            index = max(indexes)
+        index = self._new_id()
 
         # create new row in _data
         newrow['___id'] = index
@@ -134,20 +256,50 @@ class Table(Base):
     
         return index
 
-    def update(self, index, *args, **kwargs):
-        #row_to_update = list(filter(lambda x: x['___id'] == index, self._data))
-        pass
+    def insert(self, position, newrow):
+        """ add a row at position, returns its id
+        """
+        index = self._new_id()
+        self._data.insert(position, newrow)
+        self._append_wrapper(newrow, index, position)
+
+        for callback in self._observers_data_change:
+            callback(self._data)
+
+        return index
+
+    def _lookup(self, key):
+        """ row dict by key, or by id when the table has no key
+        """
+        if self._key:
+            return self._by_key.get(key)
+        return self._by_id.get(key)
+
+    def update(self, key, **values):
+        """ set the values of one row in place, only changed cells are
+            touched
+        """
+        row = self._lookup(key)
+        if row is None:
+            return False
+
+        self._set_cells(row, values)
+        for callback in self._observers_data_change:
+            callback(self._data)
+        return True
+
+    def remove(self, key):
+        row = self._lookup(key)
+        if row is None:
+            return False
 
-    def remove(self, index):
-        pass
-        '''
-        row_to_remove = list(filter(lambda x: x['___id'] == index, self._data))
-        import pdb;pdb.set_trace()
+        self._drop(row)
+        self._data = [x for x in self._data if x is not row]
 
         # call the observers
         for callback in self._observers_data_change:
             callback(self._data)
-        '''
+        return True
 
     def subscribe(self, event, callback):
         if event == 'on_select_row':
@@ -165,9 +317,13 @@ class Table(Base):
         """ Handler for toga.Table() on_select
         """
         if row:
-            filter_row = list(filter(lambda x: x['___id'] == getattr(row, '___id'), self._data))
-            if len(filter_row) > 0:
-                self.selected_row = filter_row[0]
+            row_id = getattr(row, '___id', None)
+            if self._source:
+                selected = self._source.get(row_id)
+            else:
+                selected = self._by_id.get(row_id)
+            if selected:
+                self.selected_row = selected
 
     def refresh(self):
         self._toga_table.refresh()
\ No newline at end of file
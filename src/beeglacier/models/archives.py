@@ -0,0 +1,233 @@
+from datetime import datetime, timezone
+
+from peewee import (
+    Model,
+    CharField,
+    TextField,
+    TimestampField,
+    BooleanField,
+    BigIntegerField,
+    chunked
+)
+
+from . import db, get_timestamp
+from .deleted_archives import DeletedArchive
+from .inventory_diffs import InventoryDiff, ADDED, REMOVED, CHANGED
+
+INSERT_BATCH = 100  # rows per insert, keeps below sqlite's variable limit
+COMPARED_FIELDS = ['description', 'size', 'creation_date', 'tree_hash']
+
+
+class Archive(Model):
+    """ One archive of a vault, as listed by its last inventory
+    """
+    vaultname = CharField()
+    archiveid = CharField()
+    description = TextField(default='')
+    size = BigIntegerField(default=0)
+    creation_date = CharField(default='')
+    tree_hash = CharField(default='')
+    inventory_job_id = CharField(null=True)
+    deleting = BooleanField(default=False)
+    updated_at = TimestampField(default=get_timestamp)
+
+    class Meta:
+        database = db
+        table_name = 'archives'
+        indexes = (
+            (('vaultname', 'archiveid'), True),
+            (('vaultname', 'creation_date'), False),
+            (('vaultname', 'deleting'), False),
+        )
+
+    @staticmethod
+    def from_inventory(vaultname, job_id, item):
+        """ catalog row for an ArchiveList entry of an inventory
+        """
+        return {
+            'vaultname': vaultname,
+            'archiveid': item['ArchiveId'],
+            'description': item.get('ArchiveDescription') or '',
+            'size': int(item.get('Size') or 0),
+            'creation_date': item.get('CreationDate') or '',
+            'tree_hash': item.get('SHA256TreeHash') or '',
+            'inventory_job_id': job_id,
+            'updated_at': get_timestamp()
+        }
+
+    @staticmethod
+    def apply_inventory(vaultname, job_id, archives):
+        """ make the catalog of a vault match an inventory (an iterable of
+            ArchiveList entries), in one transaction, recording what
+            changed since the previous inventory as InventoryDiff rows.
+
+            The inventory is consumed in batches: each batch is compared
+            with the catalog rows of the same ids (unique index lookups)
+            and upserted, tagged with job_id; rows left with another job
+            id afterwards are the removed archives. No diff rows are
+            written for the first inventory of a vault.
+
+            Returns the number of added, changed and removed archives.
+        """
+        counts = {ADDED: 0, CHANGED: 0, REMOVED: 0}
+        rows = (Archive.from_inventory(vaultname, job_id, item)
+                for item in archives)
+
+        with db.atomic():
+            previous = Archive.select(Archive.inventory_job_id) \
+                              .where(Archive.vaultname == vaultname) \
+                              .first()
+            previous_job_id = previous.inventory_job_id if previous else None
+
+            def diff(archive, change):
+                counts[change] += 1
+                return {
+                    'vaultname': vaultname,
+                    'job_id': job_id,
+                    'previous_job_id': previous_job_id,
+                    'archiveid': archive['archiveid'],
+                    'change': change,
+                    'description': archive['description'],
+                    'size': archive['size'],
+                }
+
+            for batch in chunked(rows, INSERT_BATCH):
+                existing = {
+                    archive.archiveid: archive for archive in Archive.select()
+                    .where((Archive.vaultname == vaultname) &
+                           (Archive.archiveid.in_([r['archiveid']
+                                                   for r in batch])))
+                }
+                diffs = []
+                for row in batch:
+                    old = existing.get(row['archiveid'])
+                    if old is None:
+                        diffs.append(diff(row, ADDED))
+                    elif any(getattr(old, name) != row[name]
+                             for name in COMPARED_FIELDS):
+                        diffs.append(diff(row, CHANGED))
+
+                Archive.insert_many(batch).on_conflict_replace().execute()
+                if previous and diffs:
+                    InventoryDiff.insert_many(diffs).execute()
+
+            removed = Archive.select() \
+                             .where((Archive.vaultname == vaultname) &
+                                    (Archive.inventory_job_id != job_id)) \
+                             .dicts().iterator()
+            for batch in chunked(removed, INSERT_BATCH):
+                InventoryDiff.insert_many(
+                    [diff(archive, REMOVED) for archive in batch]).execute()
+            Archive.delete().where(
+                (Archive.vaultname == vaultname) &
+                (Archive.inventory_job_id != job_id)
+            ).execute()
+
+            Archive.sync_deleting(vaultname)
+        return counts
+
+    @staticmethod
+    def reconcile_deletions(vaultname, inventory_date=None):
+        """ settle the deletion requests of a vault against its catalog,
+            right after an inventory was applied
+
+            A requested archive missing from the inventory is confirmed
+            deleted and its request dropped. One still listed by an
+            inventory taken after the request was not deleted, so its
+            request is cleared too and the archive shows as normal.
+
+            :param inventory_date: InventoryDate of the inventory (ISO
+                                   8601), None when unknown (CSV)
+            Returns (confirmed, cleared)
+        """
+        listed = Archive.select(Archive.archiveid) \
+                        .where(Archive.vaultname == vaultname)
+        confirmed = DeletedArchive.delete().where(
+            (DeletedArchive.vaultname == vaultname) &
+            (DeletedArchive.archiveid.not_in(listed))
+        ).execute()
+
+        cleared = 0
+        if inventory_date:
+            taken_at = datetime.strptime(inventory_date[:19],
+                                         '%Y-%m-%dT%H:%M:%S') \
+                               .replace(tzinfo=timezone.utc).timestamp()
+            with db.atomic():
+                cleared = DeletedArchive.delete().where(
+                    (DeletedArchive.vaultname == vaultname) &
+                    (DeletedArchive.archiveid.in_(listed)) &
+                    (DeletedArchive.deleted_at < taken_at)
+                ).execute()
+                Archive.update(deleting=False).where(
+                    (Archive.vaultname == vaultname) &
+                    (Archive.archiveid.not_in(
+                        DeletedArchive.select(DeletedArchive.archiveid)
+                                      .where(DeletedArchive.vaultname == vaultname)))
+                ).execute()
+        return confirmed, cleared
+
+    @staticmethod
+    def sync_deleting(vaultname):
+        """ flag the archives with a deletion request
+        """
+        requested = DeletedArchive.select(DeletedArchive.archiveid) \
+                                  .where(DeletedArchive.vaultname == vaultname)
+        Archive.update(deleting=True).where(
+            (Archive.vaultname == vaultname) &
+            (Archive.archiveid.in_(requested))
+        ).execute()
+
+    @staticmethod
+    def mark_deleting(vaultname, archiveid):
+        Archive.update(deleting=True).where(
+            (Archive.vaultname == vaultname) &
+            (Archive.archiveid == archiveid)
+        ).execute()
+
+    @staticmethod
+    def count_vault(vaultname):
+        return Archive.select() \
+                      .where(Archive.vaultname == vaultname) \
+                      .count()
+
+    @staticmethod
+    def page(vaultname, page, page_size):
+        """ archives of a vault, oldest first; page starts at 1
+        """
+        return Archive.select() \
+                      .where(Archive.vaultname == vaultname) \
+                      .order_by(Archive.creation_date, Archive.archiveid) \
+                      .paginate(page, page_size) \
+                      .execute()
+
+    def to_row(self):
+        """ row for the archives table, keys as in the inventory
+        """
+        return {
+            'archiveid': self.archiveid,
+            'archivedescription': self.description,
+            'size': round(self.size/1024/1024, 2),
+            'creationdate': self.creation_date,
+            'sha256treehash': self.tree_hash,
+            'deletion_in_progress': 'Yes' if self.deleting else ''
+        }
+
+
+class VaultArchives():
+    """ Catalog of one vault as a table provider: the table fetches the
+        pages it draws, one query each
+    """
+
+    def __init__(self, vaultname, page_size):
+        self.vaultname = vaultname
+        self.page_size = page_size
+
+    def count(self):
+        return Archive.count_vault(self.vaultname)
+
+    def fetch(self, page, page_size):
+        return [archive.to_row()
+                for archive in Archive.page(self.vaultname, page, page_size)]
+
+    def key(self, row):
+        return row['archiveid']
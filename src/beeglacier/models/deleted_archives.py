@@ -16,4 +16,12 @@ class DeletedArchive(Model):
     
     class Meta:
         database = db
-        table_name = 'deleted_archives'
\ No newline at end of file
+        table_name = 'deleted_archives'
+
+    @staticmethod
+    def pending(vaultname):
+        """ True while the vault has deletions no inventory settled yet
+        """
+        return DeletedArchive.select() \
+                             .where(DeletedArchive.vaultname == vaultname) \
+                             .exists()
@@ -0,0 +1,40 @@
+from peewee import (
+    Model,
+    CharField,
+    TextField,
+    TimestampField,
+    BigIntegerField
+)
+
+from . import db, get_timestamp
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+CHANGE_CHOICES = [
+    (ADDED, 'Added'),
+    (REMOVED, 'Removed'),
+    (CHANGED, 'Changed')
+]
+
+
+class InventoryDiff(Model):
+    """ An archive that differs between two successive inventories of
+        a vault
+    """
+    vaultname = CharField()
+    job_id = CharField()
+    previous_job_id = CharField(null=True)
+    archiveid = CharField()
+    change = CharField(choices=CHANGE_CHOICES)
+    description = TextField(default='')
+    size = BigIntegerField(default=0)
+    created_at = TimestampField(default=get_timestamp)
+
+    class Meta:
+        database = db
+        table_name = 'inventory_diffs'
+        indexes = (
+            (('vaultname', 'job_id'), False),
+            (('vaultname', 'archiveid'), False),
+        )
@@ -1,13 +1,17 @@
+import os
+
 from peewee import (
     Model,
     CharField,
     TextField,
     TimestampField,
     BooleanField,
+    BigIntegerField,
     IntegerField
 )
 
 from . import db, get_timestamp
+from .journal import BatchedJournal
 
 
 class Job(Model):
@@ -24,4 +28,69 @@ class Job(Model):
 
     class Meta:
         database = db
-        table_name = 'jobs'
\ No newline at end of file
+        table_name = 'jobs'
+
+
+class DownloadRange(Model):
+    """ A byte range of a job output already written to the temp file
+    """
+    job_id = CharField()
+    byte_start = BigIntegerField()
+    byte_end = BigIntegerField()
+    tree_hash = CharField()
+    updated_at = TimestampField(default=get_timestamp)
+
+    class Meta:
+        database = db
+        table_name = 'download_ranges'
+        indexes = (
+            (('job_id', 'byte_start'), True),
+        )
+
+
+class DownloadJournal(BatchedJournal):
+    """ Ranges of one job output written to path, so an interrupted
+        download continues with the missing ranges only. Ranges lost in
+        a crash are downloaded again.
+    """
+
+    model = DownloadRange
+
+    def __init__(self, job_id, path, **kwargs):
+        super().__init__(**kwargs)
+        self.job_id = job_id
+        self.path = path
+
+    def load(self):
+        """ {(byte_start, byte_end): tree hash} of the journaled ranges,
+            empty (and the journal dropped) if the file is gone
+        """
+        if not os.path.exists(self.path):
+            self.clear()
+            return {}
+        rows = DownloadRange.select() \
+                            .where(DownloadRange.job_id == self.job_id) \
+                            .execute()
+        return {(row.byte_start, row.byte_end): row.tree_hash for row in rows}
+
+    def range_size(self):
+        """ range size in bytes used so far, None if nothing journaled
+        """
+        size = None
+        for start, end in self.load():
+            size = max(size or 0, end - start + 1)
+        return size
+
+    def record(self, byte_start, byte_end, tree_hash):
+        self._add({
+            'job_id': self.job_id,
+            'byte_start': byte_start,
+            'byte_end': byte_end,
+            'tree_hash': tree_hash,
+            'updated_at': get_timestamp()
+        })
+
+    def clear(self):
+        """ drop the journal once the download is complete
+        """
+        self._discard(DownloadRange.job_id == self.job_id)
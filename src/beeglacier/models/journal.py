@@ -0,0 +1,52 @@
+import threading
+import time
+
+from . import db
+
+
+class BatchedJournal():
+    """ Base for the transfer journals.
+
+        Rows are buffered and written in batches, each batch in one
+        transaction, so a crash loses at most the last batch and never
+        leaves half of one behind. Subclasses set `model`.
+
+        When the journal describes data written elsewhere, `sync` is set
+        to a callable that makes that data durable; it runs before every
+        batch, so no row is ever stored ahead of its data.
+    """
+
+    model = None
+    sync = None
+
+    def __init__(self, batch_size=50, flush_interval=5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _add(self, row):
+        with self._lock:
+            self._pending.append(row)
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if len(self._pending) >= self.batch_size or due:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        rows, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        if rows:
+            if self.sync:
+                self.sync()
+            with db.atomic():
+                self.model.insert_many(rows).on_conflict_replace().execute()
+
+    def _discard(self, where):
+        with self._lock:
+            self._pending = []
+            self.model.delete().where(where).execute()
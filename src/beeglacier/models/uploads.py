@@ -1,12 +1,17 @@
+import os
+
 from peewee import (
     Model,
     CharField,
     TextField,
     TimestampField,
-    IntegerField
+    IntegerField,
+    BigIntegerField,
+    FloatField
 )
 
-from . import db
+from . import db, get_timestamp
+from .journal import BatchedJournal
 from ..settings import STATUS_CHOICES
 
 class Upload(Model):
@@ -21,4 +26,105 @@ class Upload(Model):
     
     class Meta:
         database = db
-        table_name = 'uploads'
\ No newline at end of file
+        table_name = 'uploads'
+
+
+class UploadFile(Model):
+    """ Size and mtime of the file of an upload when its multipart
+        upload was created: parts journaled later are only trusted while
+        the file still has them
+    """
+    upload_id = TextField(primary_key=True)
+    file_size = BigIntegerField()
+    file_mtime = FloatField()
+
+    class Meta:
+        database = db
+        table_name = 'upload_files'
+
+    @staticmethod
+    def remember(upload_id, stat):
+        """ store the os.stat() taken before the upload was created
+        """
+        UploadFile.insert(upload_id=upload_id, file_size=stat.st_size,
+                          file_mtime=stat.st_mtime) \
+                  .on_conflict_replace().execute()
+
+
+class UploadPart(Model):
+    """ One uploaded part of a multipart upload, with the size and mtime
+        the file had when the part was read.
+    """
+    upload_id = TextField()
+    part_index = IntegerField()
+    byte_start = BigIntegerField()
+    byte_end = BigIntegerField()
+    tree_hash = CharField()
+    status = IntegerField(default=3, choices=STATUS_CHOICES)
+    file_size = BigIntegerField()
+    file_mtime = FloatField()
+    updated_at = TimestampField(default=get_timestamp)
+
+    class Meta:
+        database = db
+        table_name = 'upload_parts'
+        indexes = (
+            (('upload_id', 'part_index'), True),
+        )
+
+
+class UploadJournal(BatchedJournal):
+    """ Per-part journal of one upload. Parts lost in a crash are found
+        again by the list_parts reconciliation.
+    """
+
+    model = UploadPart
+
+    def __init__(self, upload_id, path, **kwargs):
+        super().__init__(**kwargs)
+        self.upload_id = upload_id
+        stat = os.stat(path)
+        created = UploadFile.get_or_none(UploadFile.upload_id == upload_id)
+        if created is None:
+            # uploads started before the file was remembered
+            UploadFile.remember(upload_id, stat)
+            created = UploadFile.get(UploadFile.upload_id == upload_id)
+        self.file_size = created.file_size
+        self.file_mtime = created.file_mtime
+        # changed since the upload was created: nothing is trusted
+        self.changed = (stat.st_size, stat.st_mtime) != \
+                       (self.file_size, self.file_mtime)
+
+    def load(self):
+        """ {part_index: tree hash} of journaled parts that can be
+            trusted without reading them: the file has not changed
+        """
+        if self.changed:
+            return {}
+        rows = UploadPart.select().where(
+            (UploadPart.upload_id == self.upload_id) &
+            (UploadPart.file_size == self.file_size) &
+            (UploadPart.file_mtime == self.file_mtime)
+        ).execute()
+        return {row.part_index: row.tree_hash for row in rows}
+
+    def record(self, part_index, byte_start, byte_end, tree_hash):
+        if self.changed:
+            return
+        self._add({
+            'upload_id': self.upload_id,
+            'part_index': part_index,
+            'byte_start': byte_start,
+            'byte_end': byte_end,
+            'tree_hash': tree_hash,
+            'file_size': self.file_size,
+            'file_mtime': self.file_mtime,
+            'updated_at': get_timestamp()
+        })
+
+    def clear(self):
+        """ drop the journal once the archive is complete
+        """
+        self._discard(UploadPart.upload_id == self.upload_id)
+        UploadFile.delete().where(UploadFile.upload_id == self.upload_id) \
+                  .execute()
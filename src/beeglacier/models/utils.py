@@ -1,10 +1,14 @@
 from . import db
 from .accounts import Account
+from .archives import Archive
 from .deleted_archives import DeletedArchive
-from .jobs import Job
-from .uploads import Upload
+from .inventory_diffs import InventoryDiff
+from .jobs import Job, DownloadRange
+from .uploads import Upload, UploadFile, UploadPart
 from .vaults import Vault
 
 def create_tables():
     with db:
-        db.create_tables([Account, DeletedArchive, Job, Upload, Vault])
\ No newline at end of file
+        db.create_tables([Account, Archive, DeletedArchive, InventoryDiff,
+                          Job, DownloadRange, Upload, UploadFile, UploadPart,
+                          Vault])
\ No newline at end of file
@@ -47,5 +47,22 @@ STATUS_CHOICES = [
     (4, 'Error')
 ]
 
-UPLOAD_PART_SIZE = 10
-DOWNLOAD_PART_SIZE = 10
\ No newline at end of file
+# part sizes in Mb (a power of 2), or 'auto' to choose them
+# from the archive size and the measured throughput
+UPLOAD_PART_SIZE = 'auto'
+# parts in flight across all uploads (shared connections)
+UPLOAD_WORKERS = 8
+# max Mb of part buffers held in memory by one upload
+UPLOAD_MEMORY_BUDGET = 256
+DOWNLOAD_PART_SIZE = 'auto'
+# ranges downloaded at the same time
+DOWNLOAD_WORKERS = 4
+# format requested for vault inventories, 'CSV' or 'JSON'. JSON is
+# always requested while deletions are pending: only its InventoryDate
+# tells whether an archive still listed outlived its deletion
+INVENTORY_FORMAT = 'CSV'
+# archives fetched at a time while scrolling the vault detail
+ARCHIVES_PAGE_SIZE = 500
+# workers for the interactive background actions (refresh, jobs,
+# deletes); uploads and downloads each run on a thread of their own
+INTERACTIVE_TASK_WORKERS = 2
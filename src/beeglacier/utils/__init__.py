@@ -1,3 +1,6 @@
+from collections import deque
+import weakref
+
 class ObsData(object):
     def __init__(self, initial = []):
         self._data = initial
@@ -26,11 +29,21 @@ class StoreContainer:
         self.containers[name] = container
 
 class Controls:
+    """ Registry of named widgets.
+
+        Names and ids are indexed both ways and widgets registered with
+        register() are kept by id, so every lookup is a dict access.
+        Widgets are held weakly, the registry never keeps one alive.
+        The app builds its widgets once and never takes them out of the
+        window, so names are not unregistered.
+    """
     _controls = None
     _toga_window = None
 
     def __init__(self):
-        self._controls = {}
+        self._controls = {}   # id -> name
+        self._ids = {}        # name -> id
+        self._widgets = weakref.WeakValueDictionary()  # id -> widget
 
     def set_window(self, window):
         self._toga_window = window
@@ -38,39 +51,52 @@ class Controls:
     def getall(self):
         return self._controls
 
-    def add(self, name, id):
-        if id not in self._controls.keys():
-            if not self.get_id(name):
-                self._controls[id] = name
-            else:
-                raise Exception('Name already used')    
-        else: 
+    def add(self, name, id, widget=None):
+        if id in self._controls:
             raise Exception('ID already used')
+        if name in self._ids:
+            raise Exception('Name already used')
+
+        self._controls[id] = name
+        self._ids[name] = id
+        if widget is not None:
+            self._widgets[id] = widget
+
+    def register(self, name, widget):
+        """ add a widget under name, keeping a reference to it
+        """
+        self.add(name, widget.id, widget)
 
     def add_from_controls(self, new_controls, prefix = ''):
         for key,value in new_controls.getall().items():
-            self.add(prefix+value,key)
+            self.add(prefix+value, key, new_controls._widgets.get(key))
 
     def get_name(self,id):
         return self._controls[id]
 
     def get_id(self,name):
-        
-        for k,v in self._controls.items():
-            if v == name:
-                return k
-        return None
+        return self._ids.get(name)
 
     def get_control_by_id(self, id):
-
-        if not self._toga_window.content:
+        widget = self._widgets.get(id)
+        if widget is not None:
+            return widget
+
+        widget = self._find_in_window(id)
+        if widget is not None and id in self._controls:
+            self._widgets[id] = widget
+        return widget
+
+    def _find_in_window(self, id):
+        """ walk the window for a widget added without a reference
+        """
+        if not self._toga_window or not self._toga_window.content:
             return None
 
-        elements = []
-        elements.append(self._toga_window.content)
+        elements = deque([self._toga_window.content])
 
         while elements:
-            current = elements.pop(0)
+            current = elements.popleft()
             
             # found control
             if current.id == id:
@@ -89,13 +115,14 @@ class Controls:
             # add children to next elements to check
             if to_add:
                 if type(to_add) == list:
-                    for el in to_add:
-                        elements.append(el)
+                    elements.extend(to_add)
                 else:
-                    elements.append(el)
+                    elements.append(to_add)
 
         return None
 
     def get_control_by_name(self, name):
         id = self.get_id(name)
-        return self.get_control_by_id(id)
\ No newline at end of file
+        if id is None:
+            return None
+        return self.get_control_by_id(id)
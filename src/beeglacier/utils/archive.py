@@ -0,0 +1,84 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import lzma
+import os
+import tarfile
+
+"""
+Streaming directory archives.
+
+A directory is written as an uncompressed tar stream into a
+ParallelXZWriter, which cuts it in fixed-size blocks and compresses
+every block as an independent xz stream on all cores. Concatenated xz
+streams are a valid .tar.xz (xz and python's lzma decode them in
+sequence), so nothing has to be staged on disk.
+"""
+
+BLOCK_SIZE = 8 * 1024 * 1024  # 8 MB of tar data per xz stream
+
+
+class ParallelXZWriter():
+    """ Write-only file object that compresses blocks in parallel.
+
+        Compressed blocks are passed to sink(data) in input order, from
+        the thread calling write()/close(). At most a few blocks per
+        worker are pending at any time.
+    """
+
+    def __init__(self, sink, block_size=BLOCK_SIZE, workers=None, preset=6):
+        self.sink = sink
+        self.block_size = block_size
+        self.preset = preset
+        self.workers = workers or os.cpu_count() or 1
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(
+            self._executor.submit(lzma.compress, block, preset=self.preset))
+
+        # hand over finished blocks, wait if too many are pending
+        while self._pending and (self._pending[0].done() or
+                                 len(self._pending) > self.workers * 2):
+            self._drain_one()
+
+    def _drain_one(self):
+        data = self._pending.popleft().result()
+        self.bytes_out += len(data)
+        self.sink(data)
+
+    def close(self):
+        """ compress what is left and hand every block to the sink
+        """
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._drain_one()
+        self._executor.shutdown()
+
+    def abort(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+
+def write_directory(path, fileobj):
+    """ write path, recursively, as a tar stream into fileobj
+    """
+    arcname = os.path.basename(os.path.normpath(path))
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        tar.add(path, arcname=arcname)
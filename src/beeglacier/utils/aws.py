@@ -1,19 +1,25 @@
-import binascii
 from concurrent.futures import (
     wait, ThreadPoolExecutor, FIRST_EXCEPTION
 )
-import hashlib
 import math
 import os.path
-import sys
-import tarfile
-import tempfile
 import threading
-import boto3
+import time
 import ntpath
 
-MAX_ATTEMPTS = 10
-fileblock = threading.Lock()
+from ..settings import UPLOAD_MEMORY_BUDGET
+from . import archive, inventory, partsize, treehash
+from .clients import ClientFactory, DEFAULT_MAX_CONNECTIONS
+from .concurrency import ConcurrencyController
+from .events import ProgressBus
+from .fileio import BufferPool, PartBody, PartReader, PartWriter, readinto
+from .retry import ChecksumMismatch, Interrupted, Retrier, ThrottleGate
+from .scheduler import get_scheduler
+from .uploadstate import UploadStateStore
+
+INITIAL_CONCURRENCY = 4
+DOWNLOAD_CHUNK_SIZE = treehash.LEAF_SIZE  # buffer per download worker
+CHECKSUMMED_OPERATIONS = ['UploadArchive', 'UploadMultipartPart']
 
 """
 Info:
@@ -21,11 +27,41 @@ Info:
     - https://a0.p.awsstatic.com/pricing/1.0/glacier/index.json?timestamp=1581568546394
 """
 
+def _pop_content_hash(params, context, **kwargs):
+    """ botocore handler: move our 'contentSHA256' param out of the api
+        params (it is not part of the Glacier model) into the request
+        context
+    """
+    content_hash = params.pop('contentSHA256', None)
+    if content_hash:
+        context['content_sha256'] = content_hash
+
+def _set_content_hash(params, **kwargs):
+    """ botocore handler: send the precomputed linear hash, so botocore's
+        glacier checksum handler does not hash the body again
+    """
+    content_hash = params['context'].get('content_sha256')
+    if content_hash:
+        params['headers']['x-amz-content-sha256'] = content_hash
+
+def _register_content_hash(client):
+    """ checksums computed by us are passed with the request
+    """
+    events = client.meta.events
+    for operation in CHECKSUMMED_OPERATIONS:
+        events.register(
+            'provide-client-params.glacier.' + operation,
+            _pop_content_hash)
+        events.register_first(
+            'before-call.glacier.' + operation,
+            _set_content_hash)
+
 class Glacier():
 
     # 
     """
-    Current Upload structure:
+    Current Upload structure (self.uploads, an UploadStateStore;
+    current_uploads is a snapshot of it):
     {
         'IDUPLOAD': {
             'vault': 'asdsad',
@@ -35,47 +71,46 @@ class Glacier():
             'status': 'UPLOADING', 'PAUSED'
             'total_parts':12, 
             'done': 2,
+            'concurrency': 4, (parts allowed in flight right now)
+            'throughput': 1048576.0, (bytes per second, last window)
             'last_response': DICT Of LAST RESPONSE FROM AWS
         }
     }
     """
-    _current_uploads = {}
-    _current_uploads_observers = []
 
     def __init__(self, account_id, access_key_id, 
-                 secret_access_key, region_name):
+                 secret_access_key, region_name,
+                 max_connections=DEFAULT_MAX_CONNECTIONS):
         self.access_key_id = access_key_id
         self.account_id = account_id
         self.secret_access_key = secret_access_key
         self.region_name = region_name
+        # bytes per second of one connection, measured by part uploads
+        self.link_throughput = None
+        # throttling seen by one worker makes every worker back off
+        self.throttle_gate = ThrottleGate()
+        # upload changes reach the observers coalesced, a few per second
+        self.progress = ProgressBus()
+        # state of the uploads of this instance (this account)
+        self.uploads = UploadStateStore(on_change=self.progress.mark)
+        self._controllers = {}
+        # one session, client and connection pool for every call;
+        # max_connections is the number of transfers in flight
+        self.clients = ClientFactory(access_key_id, secret_access_key,
+                                     region_name, max_connections)
 
     def _get_resource(self):
-        """ get session or create a new one if does not exists
-            Returns a glacier resource.
+        """ Returns the glacier resource, it shares the client's session
         """
-
-        try:
-            self.session = getattr(self,'session')
-        except AttributeError:
-            self.session = boto3.Session(
-                aws_access_key_id=self.access_key_id,
-                aws_secret_access_key=self.secret_access_key,
-                region_name=self.region_name
-            )
-
-        return self.session.resource('glacier')
+        return self.clients.resource()
 
     def _get_client(self):
+        return self.clients.client(setup=_register_content_hash)
 
-        try:
-            self.client = getattr(self,'client')
-        except AttributeError:
-            self.client = boto3.client('glacier', 
-                                    region_name=self.region_name,
-                                    aws_access_key_id=self.access_key_id,
-                                    aws_secret_access_key=self.secret_access_key)
-        
-        return self.client
+    def connection_stats(self):
+        """ usage of the transfer connections: utilization, waits
+        """
+        return self.clients.stats()
 
     def get_archive(self, vault_name, archive_id):
         return self._get_resource().Archive(self.account_id , vault_name, archive_id)
@@ -99,8 +134,15 @@ class Glacier():
     def exists_vault(self, vault_name):
         return self.get_vault(vault_name)
 
-    def initiate_inventory_retrieval(self, vault_name):
-        return self.get_vault(vault_name).initiate_inventory_retrieval()
+    def initiate_inventory_retrieval(self, vault_name, fmt=inventory.CSV):
+        """ start an inventory job, CSV by default as it parses faster;
+            returns the job id
+        """
+        response = self._get_client().initiate_job(
+            vaultName=vault_name,
+            jobParameters={'Type': 'inventory-retrieval', 'Format': fmt}
+        )
+        return response['jobId']
 
     def initiate_archive_retrieval(self, vault_name, archive_id):
         return self.get_archive(vault_name, archive_id).initiate_archive_retrieval()
@@ -111,6 +153,123 @@ class Glacier():
         else:
             return self._get_client().get_job_output(vaultName=vault_name, jobId=job_id)
         
+    def download(self, vault_name, job_id, path, size, part_size,
+                 num_threads, on_progress=None, journal=None):
+        """ Download the output of an archive retrieval job into path.
+
+            The file is preallocated and ranges are fetched concurrently,
+            each written at its own offset as soon as it arrives, so the
+            file is right whatever order ranges complete in. Ranges found
+            in the journal are already in the file and are skipped; the
+            file is synced before every journal batch, so a journaled
+            range is on disk even after a crash.
+
+            Bodies are streamed through one reusable chunk buffer per
+            worker, hashed and written in the same pass, so a worker
+            holds DOWNLOAD_CHUNK_SIZE bytes whatever the range size. A
+            range that fails its check is simply fetched and written
+            again, it is only journaled once verified.
+
+            Ranges are aligned to the tree hash, so the verified range
+            hashes combine into the archive tree hash, which is
+            returned. Journaled ranges are hashed again from the file
+            first, and fetched again unless the bytes on disk still
+            match, so the hash always stands for the file's contents.
+
+        params:
+        :param size: Archive size in bytes
+        :param part_size: Range size in Mb, rounded down to a power of 2
+        :param num_threads: Ranges in flight
+        :param on_progress: Called with (ranges done, total ranges)
+        :param journal: DownloadJournal of this job and path
+        """
+        part_size = partsize.align_part_size(part_size) * 1024 * 1024
+        ranges = [(start, min(start + part_size, size) - 1)
+                  for start in range(0, size, part_size)]
+        completed = journal.load() if journal else {}
+        journaled = [r for r in ranges if r in completed]
+
+        writer = PartWriter(path)
+        writer.preallocate(size)
+        if journal:
+            journal.sync = writer.sync
+
+        # ranges lost or damaged on disk since they were journaled
+        # (a truncated file reads back as zeros) are fetched again
+        digests = {}
+        writer.fileobj.flush()
+        on_disk = treehash.hash_ranges(
+            writer.fileobj, [(start, end - start + 1)
+                             for start, end in journaled])
+        for r, digest in zip(journaled, on_disk):
+            if digest == treehash.from_hex(completed[r]):
+                digests[r] = digest
+        missing = [r for r in ranges if r not in digests]
+        progress = {'done': len(ranges) - len(missing)}
+        progress_lock = threading.Lock()
+        local = threading.local()
+
+        def fetch_range(start, end):
+            param_range = 'bytes={}-{}'.format(start, end)
+            if not hasattr(local, 'buffer'):
+                local.buffer = bytearray(DOWNLOAD_CHUNK_SIZE)
+            buffer = local.buffer
+            view = memoryview(buffer)
+
+            def fetch():
+                hasher = treehash.TreeHash()
+                offset = start
+                # the connection is busy until the body is read
+                with self.clients.gate.slot():
+                    result = self.get_job_output(vault_name, job_id,
+                                                 range=param_range)
+                    body = result['body']
+                    while True:
+                        count = readinto(body, buffer)
+                        if not count:
+                            break
+                        hasher.update(view[:count])
+                        writer.write(offset, view[:count])
+                        offset += count
+
+                digest = hasher.digest()
+                checksum = treehash.to_hex(digest)
+                if offset != end + 1 or \
+                   (result.get('checksum') and result['checksum'] != checksum):
+                    raise ChecksumMismatch(param_range)
+                return digest
+
+            digest = self.retry(fetch)
+            if journal:
+                journal.record(start, end, treehash.to_hex(digest))
+
+            with progress_lock:
+                digests[(start, end)] = digest
+                progress['done'] += 1
+                done = progress['done']
+            if on_progress:
+                on_progress(done, len(ranges))
+
+        try:
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                futures_list = [executor.submit(fetch_range, start, end)
+                                for start, end in missing]
+                done, not_done = wait(futures_list,
+                                      return_when=FIRST_EXCEPTION)
+                for future in not_done:
+                    future.cancel()
+                for future in done:
+                    # raises the first error, if any
+                    future.result()
+        finally:
+            if journal:
+                # synced while the file is still open
+                journal.flush()
+                journal.sync = None
+            writer.close()
+
+        return treehash.to_hex(treehash.combine([digests[r] for r in ranges]))
+
     def describe_job(self, vault_name, job_id):
         client = self._get_client()
         try:
@@ -142,19 +301,13 @@ class Glacier():
             partSize=str(part_size)
         )
 
-        new_upload_info = {
-            'vault': vault_name,
-            'description': arc_desc,
-            'path': path,
-            'status':'NOT_STARTED',
-            'total_parts': 0, 
-            'uploading': 0, 
-            'done': 0
-        }
-
-        self.temp_current = self.current_uploads
-        self.temp_current[response['uploadId']] = new_upload_info
-        self.current_uploads = self.temp_current
+        self.uploads.create(
+            response['uploadId'],
+            vault=vault_name,
+            description=arc_desc,
+            path=path,
+            status='NOT_STARTED'
+        )
         return response['uploadId']
 
     def abort_upload(self, vaultname, upload_id):
@@ -168,23 +321,50 @@ class Glacier():
            response['ResponseMetadata']['HTTPStatusCode'] == 204:
             # Aborted OK
             to_update = {'status': 'ABORTED', 'last_response': response}
-            self._update_current_upload(upload_id, to_update)
+            self.uploads.update(upload_id, **to_update)
             return response
         else:
             return False
         
-    def upload(self, vault, path, desc, part_size, num_threads, upload_id):
+    def upload(self, vault, path, desc, part_size, num_threads, upload_id,
+               memory_budget=UPLOAD_MEMORY_BUDGET, priority=0, journal=None):
         """
         params:
         :param vault: Name of vault to upload file
         :param path: Path of file to upload
         :param desc: Description of file
-        :param part_size: Sizes in Mb 
-        :param num_threads: Num of worker threads
+        :param part_size: Sizes in Mb, or 'auto' to pick it from the
+                          file size and the measured throughput. Ignored
+                          when upload_id is given, the existing upload
+                          keeps the part size it was created with
+        :param num_threads: Max parts of this upload in flight; workers
+                            come from the shared upload scheduler
         :param upload_id: Upload identificator of aws
+        :param memory_budget: Max Mb of part buffers in flight (at least
+                              one part is always allowed)
+        :param priority: Higher priority uploads get free workers first
+        :param journal: Optional part journal (models.uploads.UploadJournal)
+                        recording uploaded parts, used to resume without
+                        reading parts again
         """
 
         self.glacier = self._get_client()
+
+        # a resumed upload starts over; a pause from now on wins
+        self.uploads.update_if(
+            upload_id, lambda upload: upload.status in ['PAUSED', 'ERROR'],
+            status='NOT_STARTED')
+
+        parts = None
+        if upload_id is not None:
+            # parts already uploaded, and their size, decide how the
+            # rest is sent; it has to be known before anything else
+            parts, part_size = self._list_uploaded_parts(vault, upload_id)
+            part_size = part_size // (1024 * 1024)
+        elif part_size == partsize.AUTO:
+            part_size = self.auto_part_size(partsize.path_size(path),
+                                            memory_budget=memory_budget,
+                                            num_workers=num_threads)
         
         # Validate part_size
         if not math.log2(part_size).is_integer():
@@ -193,29 +373,38 @@ class Glacier():
             raise ValueError('part_size > 1 MB and < 4096 MB')
 
         if os.path.isdir(path):
-            # path is a dir, tar file
-            file_to_upload = tempfile.TemporaryFile()
-            tar = tarfile.open(fileobj=file_to_upload, mode='w:xz')
-            for filename in path:
-                tar.add(filename)
-            tar.close()
-        else:
-            # path is a file
-            file_to_upload = open(path, mode='rb')
+            # path is a dir, stream it as tar.xz
+            return self._upload_stream(vault, path, desc, part_size,
+                                       num_threads, upload_id, memory_budget,
+                                       priority, parts)
+
+        # path is a file
+        file_to_upload = open(path, mode='rb')
 
         part_size = part_size * 1024 * 1024
-        file_size = file_to_upload.seek(0, 2)
+        reader = PartReader(file_to_upload)
+        file_size = reader.size
+
+        # counts every byte that goes through sha256 in this upload
+        hashed = treehash.HashCounter()
 
         if file_size < part_size:
-            # small files, upload directly
+            # small files, upload directly. The file is hashed leaf by
+            # leaf and streamed as the body, it is never read whole
+            digest, linear = treehash.reader_hashes(reader, file_size,
+                                                    hashed)
+            reader.fileobj.seek(0)
 
             params = {
                 'vaultName': vault,
                 'archiveDescription': desc,
-                'body': file_to_upload
+                'body': reader.fileobj,
+                'checksum': treehash.to_hex(digest),
+                'contentSHA256': treehash.to_hex(linear)
             }
 
-            response = self.glacier.upload_archive(**params)
+            with self.clients.gate.slot():
+                response = self.glacier.upload_archive(**params)
 
             # update in-memory uploads status
             to_update = {
@@ -223,11 +412,12 @@ class Glacier():
                 'total_parts': 1, 
                 'uploading': 0,
                 'done': 1,
+                'hashed_bytes': hashed.value,
                 'last_response': response
             }
-            self._update_current_upload(upload_id, to_update)
+            self.uploads.update(upload_id, **to_update)
 
-            file_to_upload.close()
+            reader.close()
             return
 
         # Upload has multiple parts
@@ -248,26 +438,10 @@ class Glacier():
                 list_of_checksums.append(None)
 
             num_parts = len(job_list)
+            pool = self._create_buffer_pool(
+                part_size, min(num_threads, num_parts), memory_budget)
         else:
-            # Resume upload
-
-            # get uploaded parts 
-            response = self.glacier.list_parts(
-                vaultName=vault,
-                uploadId=upload_id
-            )
-            parts = response['Parts']
-            part_size = response['PartSizeInBytes']
-            while 'Marker' in response:
-                # if Marker then is paginated, 
-                # so, it necessary to call same endpoint
-                # until Marker dissapear
-                response = self.glacier.list_parts(
-                    vaultName=vault,
-                    uploadId=upload_id,
-                    marker=response['Marker']
-                )
-                parts.extend(response['Parts'])
+            # Resume upload, with the parts listed above
 
             # add parts to job_list
             for byte_pos in range(0, file_size, part_size):
@@ -275,77 +449,111 @@ class Glacier():
                 list_of_checksums.append(None)
 
             num_parts = len(job_list)
+            pool = self._create_buffer_pool(
+                part_size, min(num_threads, num_parts), memory_budget)
             
             # for each part check if it was correctly uploaded
             # if was it Ok, then remove it from job_list,
-            # because it's not necessary upload again
+            # because it's not necessary upload again. The digest is
+            # kept, so the part is never hashed again in this upload.
+            # Parts journaled with the same hash while the file had its
+            # current size and mtime are trusted without reading them
+            journaled = journal.load() if journal else {}
+            uploaded = set()
+            to_verify = []
             for part_data in parts:
                 byte_start = int(part_data['RangeInBytes'].partition('-')[0])
-                file_to_upload.seek(byte_start)
-                part = file_to_upload.read(part_size)
-                checksum = self.calculate_tree_hash(part, part_size)
+                part_num = byte_start // part_size
+                remote_hash = part_data['SHA256TreeHash']
 
-                if checksum == part_data['SHA256TreeHash']:
-                    job_list.remove(byte_start)
-                    part_num = byte_start // part_size
-                    list_of_checksums[part_num] = checksum
+                if journaled.get(part_num) == remote_hash:
+                    uploaded.add(byte_start)
+                    list_of_checksums[part_num] = treehash.from_hex(remote_hash)
+                else:
+                    to_verify.append((byte_start, remote_hash))
+
+            # the remaining parts are hashed in parallel, across cores
+            digests = treehash.hash_ranges(
+                reader.fileobj,
+                [(byte_start, part_size) for byte_start, _ in to_verify],
+                counter=hashed)
+            for (byte_start, remote_hash), digest in zip(to_verify, digests):
+                if digest != treehash.from_hex(remote_hash):
+                    continue
+                part_num = byte_start // part_size
+                uploaded.add(byte_start)
+                list_of_checksums[part_num] = digest
+                if journal:
+                    byte_end = min(byte_start + part_size, file_size) - 1
+                    journal.record(part_num, byte_start, byte_end, remote_hash)
+
+            job_list = [pos for pos in job_list if pos not in uploaded]
 
         # update in-class-memory state
-        to_update = {
-            'status': 'UPLOADING', 
-            'total_parts': num_parts, 
-            'done': num_parts-len(job_list)
-        }
-        self._update_current_upload(upload_id, to_update)
+        self._mark_uploading(upload_id, total_parts=num_parts,
+                             done=num_parts-len(job_list))
 
         
-        with ThreadPoolExecutor(max_workers=num_threads) as executor:
-            futures_list = {
-                executor.submit(
-                    self.upload_part, 
-                    job, 
-                    vault, 
-                    upload_id, 
-                    part_size,
-                    file_to_upload,
-                    file_size, 
-                    num_parts
-                ): job // part_size for job in job_list}
-            
-            done, not_done = wait(futures_list, return_when=FIRST_EXCEPTION)
-            
-            if len(not_done) > 0:
-
-                # an exception occured
-                for future in not_done:
-                    future.cancel()
-                for future in done:
-                    e = future.exception()
-                    if e is not None:
-                        print('Exception occured: %r' % e)
-                
-                file_to_upload.close()
-                sys.exit(1)
-
-            else:
-                # all threads completed without raising error
-                for future in done:
-                    job_index = futures_list[future]
-                    list_of_checksums[job_index] = future.result()
+        # producer: a part is only queued once the controller lets it in
+        # flight and it has a buffer, so the loop blocks while the
+        # concurrency limit or the in-flight budget is used up
+        failed = threading.Event()
+        controller = self._create_controller(upload_id, num_threads)
+        part_finished = self._part_finished_callback(pool, controller, failed)
+
+        scheduler = get_scheduler()
+        scheduler.register(upload_id, priority)
+        futures_list = {}
+        for job in job_list:
+            controller.acquire()
+            buffer = pool.acquire()
+            if failed.is_set():
+                pool.release(buffer)
+                controller.release()
+                break
 
-        if len(list_of_checksums) != num_parts:
-            # creates list of checksum
-            list_of_checksums = []
-            for byte_pos in range(0, file_size, part_size):
-                part_num = int(byte_pos / part_size)
-                file_to_upload.seek(byte_pos)
-                part = file_to_upload.read(part_size)
-                list_of_checksums.append(
-                    self.calculate_tree_hash(part, part_size)
-                )
+            future = scheduler.submit(
+                upload_id,
+                self.upload_part, 
+                job, 
+                vault, 
+                upload_id, 
+                part_size,
+                reader,
+                file_size, 
+                num_parts,
+                hashed,
+                buffer,
+                journal
+            )
+            future.add_done_callback(
+                lambda f, b=buffer: part_finished(f, b))
+            futures_list[future] = job // part_size
+        
+        def on_failure():
+            reader.close()
+            if journal:
+                journal.flush()
+
+        done = self._wait_parts(upload_id, futures_list, failed, on_failure)
+        for future in done:
+            job_index = futures_list[future]
+            list_of_checksums[job_index] = future.result()
+
+        # only parts without a digest need to be read again
+        missing = [part_num for part_num, digest
+                   in enumerate(list_of_checksums) if digest is None]
+        digests = treehash.hash_ranges(
+            reader.fileobj,
+            [(part_num * part_size, part_size) for part_num in missing],
+            counter=hashed)
+        for part_num, digest in zip(missing, digests):
+            list_of_checksums[part_num] = digest
 
         # calculate hash
-        total_tree_hash = self.calculate_total_tree_hash(list_of_checksums)
+        total_tree_hash = treehash.to_hex(
+            treehash.combine(list_of_checksums)
+        )
 
         # Complete multipart upload
         response = self.glacier.complete_multipart_upload(
@@ -355,151 +563,411 @@ class Glacier():
             checksum=total_tree_hash
         )
         
+        if journal:
+            journal.clear()
+
         # update status
-        to_update = {'last_response': response, 'status': 'FINISHED'}
-        self._update_current_upload(upload_id, to_update)
+        to_update = {
+            'last_response': response,
+            'status': 'FINISHED',
+            'hashed_bytes': hashed.value
+        }
+        self.uploads.update(upload_id, **to_update)
 
         # close and return response
-        file_to_upload.close()
+        reader.close()
         return response
 
-    def upload_part(self, byte_pos, vault_name, upload_id, part_size, fileobj, file_size,
-                    num_parts):
+    def _upload_stream(self, vault, path, desc, part_size, num_threads,
+                       upload_id, memory_budget, priority=0, parts=None):
+        """ Upload a directory as a .tar.xz without a temporary copy.
 
-        part_num = byte_pos // part_size
-        
-        if self._current_uploads[upload_id]['status'] in ['PAUSING', 'ABORTED']:
-            sys.exit(1)
+            The tar stream is compressed in parallel blocks and cut in
+            part_size parts as it is produced; each part is hashed once
+            and sent while the next one fills. Archive size and tree hash
+            are known once the stream ends. parts are the parts already
+            uploaded when upload_id is given.
+        """
+        part_size = part_size * 1024 * 1024
+        hashed = treehash.HashCounter()
 
-        fileblock.acquire()
-        fileobj.seek(byte_pos)
-        part = fileobj.read(part_size)
-        fileblock.release()
+        if upload_id is None:
+            response = self.glacier.initiate_multipart_upload(
+                vaultName=vault,
+                archiveDescription=desc,
+                partSize=str(part_size)
+            )
+            upload_id = response['uploadId']
+            uploaded = {}
+        else:
+            # parts already sent are skipped if the stream reproduces them
+            uploaded = {
+                int(p['RangeInBytes'].partition('-')[0]): p['SHA256TreeHash']
+                for p in parts
+            }
 
-        range_header = 'bytes {}-{}/{}'.format(
-            byte_pos, byte_pos + len(part) - 1, file_size)
-        
-        percentage = part_num / num_parts
+        self._mark_uploading(upload_id, total_parts=0, done=0)
 
-        uploading = self.current_uploads[upload_id]['uploading'] + 1
-        self._update_current_upload(upload_id, {'uploading': uploading})
+        pool = self._create_buffer_pool(part_size, num_threads + 1,
+                                        memory_budget)
+        failed = threading.Event()
+        controller = self._create_controller(upload_id, num_threads)
+        list_of_checksums = []
+        futures_list = {}
+        state = {'buffer': pool.acquire(), 'filled': 0, 'size': 0}
+        part_finished = self._part_finished_callback(pool, controller, failed)
+
+        def send_buffer():
+            if failed.is_set():
+                raise RuntimeError('Part upload failed, stopping stream')
+
+            buffer, filled = state['buffer'], state['filled']
+            byte_pos = state['size']
+            part = memoryview(buffer)[:filled]
+            digest, linear = treehash.part_hashes(part, hashed)
+            list_of_checksums.append(digest)
+            state['size'] += filled
+
+            if uploaded.get(byte_pos) == treehash.to_hex(digest):
+                self.uploads.add(upload_id, total_parts=1, done=1)
+                state['filled'] = 0
+                return
+            self.uploads.add(upload_id, total_parts=1)
+
+            controller.acquire()
+            future = scheduler.submit(
+                upload_id, self._send_part, part, byte_pos, vault, upload_id,
+                part_size, None, None, digest, linear)
+            future.add_done_callback(
+                lambda f, b=buffer: part_finished(f, b))
+            futures_list[future] = len(list_of_checksums) - 1
+
+            # blocks while the in-flight budget is used up
+            state['buffer'] = pool.acquire()
+            state['filled'] = 0
+
+        def sink(data):
+            view = memoryview(data)
+            while len(view):
+                take = min(part_size - state['filled'], len(view))
+                state['buffer'][state['filled']:state['filled'] + take] = \
+                    view[:take]
+                state['filled'] += take
+                view = view[take:]
+                if state['filled'] == part_size:
+                    send_buffer()
+
+        scheduler = get_scheduler()
+        scheduler.register(upload_id, priority)
+        writer = archive.ParallelXZWriter(sink)
+        stream_error = None
+        try:
+            archive.write_directory(path, writer)
+            writer.close()
+            if state['filled'] or not list_of_checksums:
+                send_buffer()
+        except Exception as e:
+            writer.abort()
+            failed.set()
+            stream_error = e
+
+        self._wait_parts(upload_id, futures_list, failed,
+                         error=stream_error)
+
+        file_size = state['size']
+        total_tree_hash = treehash.to_hex(
+            treehash.combine(list_of_checksums)
+        )
 
-        print('Uploading part {0} of {1}... ({2:.2%})'.format(
-            part_num + 1, num_parts, percentage))
+        # Complete multipart upload
+        response = self.glacier.complete_multipart_upload(
+            vaultName=vault, 
+            uploadId=upload_id,
+            archiveSize=str(file_size), 
+            checksum=total_tree_hash
+        )
+
+        # update status
+        to_update = {
+            'last_response': response,
+            'status': 'FINISHED',
+            'hashed_bytes': hashed.value
+        }
+        self.uploads.update(upload_id, **to_update)
+        return response
 
-        for i in range(MAX_ATTEMPTS):
+    def auto_part_size(self, size, max_parts=partsize.MAX_PARTS,
+                       memory_budget=None, num_workers=None):
+        """ part size in Mb for an archive (or download) of size bytes,
+            see partsize.choose_part_size
+        """
+        return partsize.choose_part_size(size, self.link_throughput,
+                                         max_parts, memory_budget,
+                                         num_workers)
 
-            if self._current_uploads[upload_id]['status'] in ['PAUSING', 'ABORTED']:
-                continue
+    def _create_controller(self, upload_id, num_threads):
+        """ AIMD controller for the parts of one upload in flight,
+            between 1 and num_threads
+        """
+        controller = ConcurrencyController(
+            1, num_threads, min(INITIAL_CONCURRENCY, num_threads))
+        self._controllers[upload_id] = controller
+        self.uploads.update(upload_id, concurrency=controller.limit,
+                            throughput=0.0)
+        return controller
+
+    def _list_uploaded_parts(self, vault, upload_id):
+        """ all parts of a multipart upload, and its part size
+        """
+        response = self.glacier.list_parts(
+            vaultName=vault,
+            uploadId=upload_id
+        )
+        parts = response['Parts']
+        part_size = response['PartSizeInBytes']
+        while 'Marker' in response:
+            # if Marker then is paginated, 
+            # so, it necessary to call same endpoint
+            # until Marker dissapear
+            response = self.glacier.list_parts(
+                vaultName=vault,
+                uploadId=upload_id,
+                marker=response['Marker']
+            )
+            parts.extend(response['Parts'])
+        return parts, part_size
 
-            try:
-                response = self.glacier.upload_multipart_part(
-                    vaultName=vault_name, uploadId=upload_id,
-                    range=range_header, body=part)
-                checksum = self.calculate_tree_hash(part, part_size)
-                if checksum != response['checksum']:
-                    print('Checksums do not match. Will try again.')
+    def _part_finished_callback(self, pool, controller, failed):
+        """ done callback(future, buffer) of the parts of one upload: it
+            frees the part's buffer and slot, and sets failed on errors
+        """
+        def part_finished(future, buffer):
+            pool.release(buffer)
+            controller.release()
+            if not future.cancelled() and future.exception() is not None:
+                failed.set()
+        return part_finished
+
+    def _wait_parts(self, upload_id, futures_list, failed, on_failure=None,
+                    error=None):
+        """ wait for the submitted parts of an upload and returns them.
+            If any failed (or failed is set) the others are cancelled,
+            the running ones waited for and on_failure() called. Then
+            the error of the first failed part is raised, else error (met
+            by the caller), else Interrupted: the upload was paused or
+            aborted. Errors other than Interrupted leave the upload in
+            'ERROR' status, with the error
+        """
+        done, not_done = wait(futures_list, return_when=FIRST_EXCEPTION)
+
+        get_scheduler().unregister(upload_id)
+        self._controllers.pop(upload_id, None)
+        if len(not_done) > 0 or failed.is_set():
+            # an exception occured
+            for future in not_done:
+                future.cancel()
+            part_error = None
+            for future in done:
+                if future.cancelled():
                     continue
+                part_error = part_error or future.exception()
 
-                # if everything worked, then we can break
-                break
-            except: 
-                print('Upload error:', sys.exc_info()[0])
-                print('Trying again. Part {0}'.format(part_num + 1))
+            # parts already running still use the file and buffers
+            wait(not_done)
+            if on_failure:
+                on_failure()
+
+            error = part_error or error or Interrupted()
+            if not isinstance(error, Interrupted):
+                self.uploads.update(upload_id, status='ERROR',
+                                    error=repr(error))
+            raise error
+
+        return done
+
+    def _create_buffer_pool(self, part_size, max_buffers, memory_budget):
+        """ part buffers for one upload: never more than the budget
+            allows or than max_buffers
+        """
+        budget_parts = memory_budget * 1024 * 1024 // part_size
+        count = max(1, min(budget_parts, max_buffers))
+        return BufferPool(part_size, count)
+
+    def upload_part(self, byte_pos, vault_name, upload_id, part_size, reader, file_size,
+                    num_parts, hashed=None, buffer=None, journal=None):
+
+        if self._is_stopping(upload_id):
+            raise Interrupted()
+
+        if buffer is None:
+            buffer = bytearray(part_size)
+        length = reader.readinto(byte_pos, buffer)
+        part = memoryview(buffer)[:length]
+
+        # every leaf is hashed once, retries and botocore reuse the digests
+        digest, linear = treehash.part_hashes(part, hashed)
+
+        digest = self._send_part(part, byte_pos, vault_name, upload_id,
+                                 part_size, file_size, num_parts,
+                                 digest, linear)
+        if journal:
+            journal.record(byte_pos // part_size, byte_pos,
+                           byte_pos + length - 1, treehash.to_hex(digest))
+        return digest
+
+    def _send_part(self, part, byte_pos, vault_name, upload_id, part_size,
+                   file_size, num_parts, digest, linear):
+        """ upload one part whose hashes are already known. file_size
+            and num_parts are None while the archive is still streaming
+        """
+        part_num = byte_pos // part_size
+
+        range_header = 'bytes {}-{}/{}'.format(
+            byte_pos, byte_pos + len(part) - 1, file_size or '*')
+
+        checksum = treehash.to_hex(digest)
+        content_hash = treehash.to_hex(linear)
+        controller = self._controllers.get(upload_id)
+
+        self.uploads.add(upload_id, uploading=1)
+
+        if num_parts:
+            percentage = part_num / num_parts
+            print('Uploading part {0} of {1}... ({2:.2%})'.format(
+                part_num + 1, num_parts, percentage))
         else:
-            #print('After multiple attempts, still failed to upload part')
-            #print('Exiting.')
-            sys.exit(1)
-
-        self.temp_current = self.current_uploads
-        self.temp_current[upload_id]['uploading'] -= 1
-        self.temp_current[upload_id]['done'] += 1
-        self.current_uploads = self.temp_current
-        
-        del part
+            print('Uploading part {0}...'.format(part_num + 1))
+
+        def send():
+            with self.clients.gate.slot():
+                started = time.monotonic()
+                response = self.glacier.upload_multipart_part(
+                    vaultName=vault_name, uploadId=upload_id,
+                    range=range_header, body=PartBody(part),
+                    checksum=checksum, contentSHA256=content_hash)
+                elapsed = time.monotonic() - started
+            if checksum != response['checksum']:
+                raise ChecksumMismatch('Part {0}'.format(part_num + 1))
+            return elapsed
+
+        def on_error(error, kind):
+            if controller:
+                controller.on_error(error)
+            print('Upload error ({0}): {1!r}'.format(kind, error))
+            print('Trying again. Part {0}'.format(part_num + 1))
 
-        # If pausing signal then change status to PAUSED if is the last
-        # one in finishing upload
-        current_status = self._current_uploads[upload_id]['status']
-        uploading = self._current_uploads[upload_id]['uploading']
-        if current_status == 'PAUSING' and not uploading:
-            to_update = {'status': 'PAUSED'}
-            self._update_current_upload(upload_id, to_update)
+        try:
+            elapsed = self.retry(
+                send,
+                should_stop=lambda: self._is_stopping(upload_id),
+                on_error=on_error)
+        except BaseException:
+            # paused, aborted or out of retries
+            self.uploads.add(upload_id, uploading=-1)
+            self._check_paused(upload_id)
+            raise
+
+        self._record_throughput(len(part), elapsed)
+        if controller:
+            controller.on_success(len(part), elapsed)
+
+        self.uploads.add(upload_id, uploading=-1, done=1)
+        if controller:
+            self.uploads.update(upload_id, concurrency=controller.limit,
+                                throughput=controller.throughput)
+
+        self._check_paused(upload_id)
+        return digest
+
+    def retry(self, fn, *args, should_stop=None, on_error=None, **kwargs):
+        """ run fn with backoff retries, sharing this client's
+            throttle gate with every other worker
+        """
+        retrier = Retrier(self.throttle_gate)
+        return retrier.call(fn, *args, should_stop=should_stop,
+                            on_error=on_error, **kwargs)
+
+    def _is_stopping(self, upload_id):
+        # a pause completes as soon as nothing is in flight, parts still
+        # queued must not be sent then; a removed upload stops too
+        return self.uploads.get(upload_id, 'status', 'ABORTED') \
+            in ['PAUSING', 'PAUSED', 'ABORTED']
+
+    def _mark_uploading(self, upload_id, **counts):
+        """ set the part counts, and the UPLOADING status unless the
+            upload was paused or aborted while it was being prepared
+        """
+        self.uploads.update(upload_id, **counts)
+        self.uploads.update_if(
+            upload_id, lambda upload: upload.status == 'NOT_STARTED',
+            status='UPLOADING')
+
+    def _check_paused(self, upload_id):
+        """ If pausing signal then change status to PAUSED if is the
+            last one in finishing upload (checked and set atomically)
+        """
+        self.uploads.update_if(
+            upload_id,
+            lambda upload: upload.status == 'PAUSING' and not upload.uploading,
+            status='PAUSED')
 
-        return checksum
+    def _record_throughput(self, nbytes, seconds):
+        """ keep a smoothed per-connection throughput for part sizing
+        """
+        if seconds <= 0:
+            return
+        measured = nbytes / seconds
+        if self.link_throughput is None:
+            self.link_throughput = measured
+        else:
+            self.link_throughput += 0.2 * (measured - self.link_throughput)
 
     def calculate_tree_hash(self, part, part_size):
-        checksums = []
-        upper_bound = min(len(part), part_size)
-        step = 1024 * 1024  # 1 MB
-        for chunk_pos in range(0, upper_bound, step):
-            chunk = part[chunk_pos:chunk_pos+step]
-            checksums.append(hashlib.sha256(chunk).hexdigest())
-            del chunk
-        return self.calculate_total_tree_hash(checksums)
+        """ hex tree hash of (at most part_size bytes of) part
+        """
+        return treehash.to_hex(treehash.tree_hash(memoryview(part)[:part_size]))
+
+    def calculate_file_tree_hash(self, path, workers=None):
+        """ hex tree hash of a whole file, hashed on all cores
+        """
+        with open(path, mode='rb') as fileobj:
+            return treehash.to_hex(treehash.hash_file(fileobj, workers))
 
     def calculate_total_tree_hash(self,list_of_checksums):
-        tree = list_of_checksums[:]
-        while len(tree) > 1:
-            parent = []
-            for i in range(0, len(tree), 2):
-                if i < len(tree) - 1:
-                    part1 = binascii.unhexlify(tree[i])
-                    part2 = binascii.unhexlify(tree[i + 1])
-                    parent.append(hashlib.sha256(part1 + part2).hexdigest())
-                else:
-                    parent.append(tree[i])
-            tree = parent
-        return tree[0]
+        """ hex tree hash from a list of hex checksums
+        """
+        digests = [treehash.from_hex(c) for c in list_of_checksums]
+        return treehash.to_hex(treehash.combine(digests))
 
     def subscribe(self, event, callback):
+        """ 'current_uploads_change': callback(changed upload ids), at
+            most ProgressBus.rate times per second
+        """
         if event == 'current_uploads_change':
-            self._current_uploads_observers.append(callback)
+            self.progress.subscribe(callback)
 
     @property
     def current_uploads(self):
-        return self._current_uploads
-
-    @current_uploads.setter
-    def current_uploads(self, value):
-        self._current_uploads = value
-        for callback in self._current_uploads_observers:
-            callback()
-
-    def _update_current_upload(self, up_id, to_update):
-        """ update some keys of one upload 
-            - to_update is a dict
+        """ consistent snapshot of every upload, as dicts
         """
-        for key, value in to_update.items():
-            self._current_uploads[up_id][key] = value
-
-        for callback in self._current_uploads_observers:
-            callback()
+        return self.uploads.snapshot()
 
     def send_pause_upload_signal(self, upload_id):
-        self._current_uploads[upload_id]['status'] = 'PAUSING'
-
-        for callback in self._current_uploads_observers:
-            callback()
+        self.uploads.update(upload_id, status='PAUSING')
+        # nothing in flight: no part will finish to complete the pause
+        self._check_paused(upload_id)
 
     def add_paused_uploads(self, vault, upload_id, path, parts, parts_done):
         filename = ntpath.basename(path)
-        self._current_uploads[upload_id] = {
-            'vault': vault,
-            'upload_id': upload_id,
-            'path': path,
-            'description': filename,
-            'status': 'PAUSED',
-            'total_parts': parts, 
-            'uploading': 0, 
-            'done': parts_done
-        }
-
-        for callback in self._current_uploads_observers:
-            callback()
+        self.uploads.create(
+            upload_id,
+            vault=vault,
+            path=path,
+            description=filename,
+            status='PAUSED',
+            total_parts=parts,
+            done=parts_done
+        )
 
     def remove_current_upload(self, upload_id):
-        del self._current_uploads[upload_id]
-
-        for callback in self._current_uploads_observers:
-            callback()
\ No newline at end of file
+        self.uploads.remove(upload_id)
\ No newline at end of file
@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+"""
+Shared boto3 session, client and resource for one account.
+
+The client's HTTP pool is sized to the transfer concurrency plus a few
+connections for interactive calls, so workers neither wait for a free
+connection inside urllib3 nor make it open (and discard) extra ones,
+repeating TLS handshakes. Transfers take a slot of the ConnectionGate
+for the whole request, body included; the gate never lets more
+transfers run than the pool keeps connections for, and measures how
+busy the pool is and how long workers wait for it.
+"""
+
+DEFAULT_MAX_CONNECTIONS = 10   # botocore's own default
+RESERVED_CONNECTIONS = 2       # kept free of transfers, for the UI calls
+CONNECT_TIMEOUT = 10           # seconds
+READ_TIMEOUT = 120             # seconds without a byte from the socket
+
+
+class ConnectionGate():
+    """ Bounded slots for transfers, with usage metrics.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._peak = 0
+        self._acquired = 0
+        self._waited = 0
+        self._wait_seconds = 0.0
+        self._max_wait = 0.0
+        self._busy_seconds = 0.0   # integral of slots in use over time
+        self._started = time.monotonic()
+        self._last_change = self._started
+
+    def _account(self):
+        """ add the time since the last change, weighted by slots in use;
+            caller holds the lock
+        """
+        now = time.monotonic()
+        self._busy_seconds += self._in_use * (now - self._last_change)
+        self._last_change = now
+
+    def acquire(self):
+        started = time.monotonic()
+        with self._cond:
+            while self._in_use >= self.size:
+                self._cond.wait()
+            waited = time.monotonic() - started
+
+            self._account()
+            self._in_use += 1
+            self._peak = max(self._peak, self._in_use)
+            self._acquired += 1
+            if waited > 0.001:
+                self._waited += 1
+            self._wait_seconds += waited
+            self._max_wait = max(self._max_wait, waited)
+
+    def release(self):
+        with self._cond:
+            self._account()
+            self._in_use -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """ pool usage since the gate was created
+        """
+        with self._cond:
+            self._account()
+            elapsed = max(self._last_change - self._started, 1e-6)
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'peak': self._peak,
+                'utilization': self._busy_seconds / (elapsed * self.size),
+                'acquired': self._acquired,
+                'waited': self._waited,
+                'wait_seconds': self._wait_seconds,
+                'max_wait': self._max_wait,
+                'mean_wait': self._wait_seconds / max(self._acquired, 1)
+            }
+
+
+class ClientFactory():
+
+    def __init__(self, access_key_id, secret_access_key, region_name,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        """ :param max_connections: transfers in flight at most
+        """
+        self.session = boto3.Session(
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            region_name=region_name
+        )
+        self.gate = ConnectionGate(max_connections)
+
+        options = {
+            'max_pool_connections': max_connections + RESERVED_CONNECTIONS,
+            'connect_timeout': connect_timeout,
+            'read_timeout': read_timeout,
+            # the Retrier retries, with the ThrottleGate shared by every
+            # worker; botocore retrying per worker first would hide
+            # throttling from it
+            'retries': {'max_attempts': 0}
+        }
+        # newer botocore only
+        if 'tcp_keepalive' in getattr(Config, 'OPTION_DEFAULTS', {}):
+            options['tcp_keepalive'] = True
+        self.config = Config(**options)
+
+        self._client = None
+        self._resource = None
+        self._lock = threading.Lock()
+
+    def client(self, setup=None):
+        """ the shared glacier client, setup(client) runs once on it
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = self.session.client('glacier',
+                                                   config=self.config)
+                if setup:
+                    setup(self._client)
+            return self._client
+
+    def resource(self):
+        """ the shared glacier resource, same session and settings
+        """
+        with self._lock:
+            if self._resource is None:
+                self._resource = self.session.resource('glacier',
+                                                       config=self.config)
+            return self._resource
+
+    def stats(self):
+        return self.gate.stats()
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from .retry import is_throttling, is_timeout
+
+"""
+AIMD concurrency control for part transfers.
+
+The limit on parts in flight grows by one every window in which the
+aggregate throughput keeps up with the best seen, and is cut down
+multiplicatively on throttling, timeouts, or when throughput drops
+while latency climbs. A window is one round of `limit` parts.
+"""
+
+DECREASE_FACTOR = 0.5
+INCREASE_TOLERANCE = 0.95   # throughput still counts as keeping up
+DROP_RATIO = 0.8            # throughput below this share of best drops
+LATENCY_RATIO = 2.0         # latency above this times the best is high
+BEST_DECAY = 0.98           # lets the best throughput age out slowly
+EWMA_WEIGHT = 0.3
+
+
+def is_congestion_error(error):
+    """ True for throttling and timeout errors
+    """
+    return is_throttling(error) or is_timeout(error)
+
+
+class ConcurrencyController():
+
+    def __init__(self, minimum=1, maximum=16, initial=None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial or self.minimum, self.minimum),
+                         self.maximum)
+        self.in_flight = 0
+        self.throughput = 0.0   # bytes per second, last window
+        self.latency = None     # seconds per part, ewma
+        self._best_throughput = 0.0
+        self._best_latency = None
+        self._cond = threading.Condition()
+        self._start_window()
+
+    def _start_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_parts = 0
+
+    def acquire(self):
+        """ block until another part may be put in flight
+        """
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self, nbytes, seconds):
+        """ record a finished part, adjusts the limit at window end
+        """
+        with self._cond:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += EWMA_WEIGHT * (seconds - self.latency)
+            if self._best_latency is None or seconds < self._best_latency:
+                self._best_latency = seconds
+
+            self._window_bytes += nbytes
+            self._window_parts += 1
+            if self._window_parts < self.limit:
+                return
+
+            elapsed = max(time.monotonic() - self._window_start, 1e-6)
+            self.throughput = self._window_bytes / elapsed
+            best = self._best_throughput
+            high_latency = self.latency > self._best_latency * LATENCY_RATIO
+
+            if best and self.throughput < best * DROP_RATIO and high_latency:
+                self._decrease()
+            elif self.throughput >= best * INCREASE_TOLERANCE:
+                self.limit = min(self.limit + 1, self.maximum)
+                self._cond.notify_all()
+
+            self._best_throughput = max(best * BEST_DECAY, self.throughput)
+            self._start_window()
+
+    def on_error(self, error):
+        """ record a failed attempt, congestion shrinks the limit
+        """
+        if is_congestion_error(error):
+            with self._cond:
+                self._decrease()
+                self._start_window()
+
+    def _decrease(self):
+        self.limit = max(self.minimum, int(self.limit * DECREASE_FACTOR))
@@ -0,0 +1,55 @@
+import threading
+import time
+
+"""
+Coalescing event bus for progress updates.
+
+Producers mark keys (upload ids) as changed as often as they like;
+subscribers are called at most `rate` times per second, once per flush,
+with the set of keys changed since the previous flush. A burst of part
+completions therefore costs one UI refresh and one database batch.
+"""
+
+DEFAULT_RATE = 10  # flushes per second
+
+
+class ProgressBus():
+
+    def __init__(self, rate=DEFAULT_RATE):
+        self.interval = 1.0 / rate
+        self._subscribers = []
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._last_flush = 0.0
+
+    def subscribe(self, callback):
+        """ callback(changed_keys) is called from the flushing thread
+        """
+        self._subscribers.append(callback)
+
+    def mark(self, key):
+        """ record a change, a flush is scheduled if none is pending
+        """
+        with self._lock:
+            self._dirty.add(key)
+            if self._timer is not None:
+                return
+            wait = self._last_flush + self.interval - time.monotonic()
+            self._timer = threading.Timer(max(0.0, wait), self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """ deliver the pending changes now
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            changed, self._dirty = self._dirty, set()
+            self._last_flush = time.monotonic()
+
+        if changed:
+            for callback in self._subscribers:
+                callback(changed)
@@ -0,0 +1,196 @@
+import mmap
+import os
+import queue
+import threading
+
+
+class PartReader():
+    """ Positional reader for a file opened in binary mode.
+
+        Every read states its own offset, so worker threads can read
+        their byte ranges concurrently without a lock and without
+        touching the shared file offset. Uses os.pread when the
+        platform has it, otherwise a read-only mmap.
+    """
+
+    def __init__(self, fileobj):
+        fileobj.flush()
+        self.fileobj = fileobj
+        self.fd = fileobj.fileno()
+        self.size = os.fstat(self.fd).st_size
+        self._mmap = None
+
+        if not hasattr(os, 'pread') and self.size:
+            self._mmap = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+    def read(self, offset, length):
+        """ return up to length bytes starting at offset
+        """
+        length = max(0, min(length, self.size - offset))
+
+        if self._mmap is not None:
+            return self._mmap[offset:offset + length]
+
+        chunks = []
+        while length > 0:
+            chunk = os.pread(self.fd, length, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+
+        if len(chunks) == 1:
+            return chunks[0]
+        return b''.join(chunks)
+
+    def readinto(self, offset, buffer):
+        """ fill buffer with bytes starting at offset, returns the
+            number of bytes read
+        """
+        view = memoryview(buffer)
+        length = max(0, min(len(view), self.size - offset))
+
+        if self._mmap is not None:
+            with memoryview(self._mmap) as source:
+                view[:length] = source[offset:offset + length]
+            return length
+
+        filled = 0
+        while filled < length:
+            if hasattr(os, 'preadv'):
+                count = os.preadv(self.fd, [view[filled:length]],
+                                  offset + filled)
+            else:
+                chunk = os.pread(self.fd, length - filled, offset + filled)
+                count = len(chunk)
+                view[filled:filled + count] = chunk
+            if not count:
+                break
+            filled += count
+        return filled
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.fileobj.close()
+
+
+class BufferPool():
+    """ Fixed set of preallocated part buffers.
+
+        acquire() blocks while every buffer is in use, which is what
+        bounds the bytes in flight during an upload.
+    """
+
+    def __init__(self, buffer_size, count):
+        self.buffer_size = buffer_size
+        self.count = count
+        self._free = queue.LifoQueue()
+        for _ in range(count):
+            self._free.put(bytearray(buffer_size))
+
+    def acquire(self):
+        return self._free.get()
+
+    def release(self, buffer):
+        self._free.put(buffer)
+
+
+class PartBody():
+    """ Read-only file-like object over a memoryview, so a pooled buffer
+        can be sent as a request body without copying it.
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def read(self, size=-1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._view)
+        self._pos = max(0, min(offset, len(self._view)))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def readinto(stream, buffer):
+    """ read from a response body straight into buffer, returns the
+        number of bytes read (0 at the end of the stream)
+
+        botocore's StreamingBody has no readinto, its underlying
+        urllib3 response does; other streams fall back to read()
+    """
+    if hasattr(stream, 'readinto'):
+        return stream.readinto(buffer)
+    raw = getattr(stream, '_raw_stream', None)
+    if raw is not None and hasattr(raw, 'readinto'):
+        return raw.readinto(buffer)
+
+    data = stream.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+
+class PartWriter():
+    """ Positional writer: every range is written at its own offset, so
+        ranges can land in any order from any thread. Uses os.pwrite,
+        or a locked seek+write where the platform lacks it.
+    """
+
+    def __init__(self, path):
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        self.fileobj = open(path, mode=mode)
+        self.fd = self.fileobj.fileno()
+        self._lock = threading.Lock()
+
+    def preallocate(self, size):
+        """ give the file its final size up front
+        """
+        if os.fstat(self.fd).st_size != size:
+            self.fileobj.truncate(size)
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+            except OSError:
+                # not supported by every filesystem, truncate is enough
+                pass
+
+    def write(self, offset, data):
+        view = memoryview(data)
+        if not hasattr(os, 'pwrite'):
+            with self._lock:
+                self.fileobj.seek(offset)
+                self.fileobj.write(view)
+            return
+
+        while len(view):
+            written = os.pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def sync(self):
+        """ make every write so far durable (fsync)
+        """
+        self.fileobj.flush()
+        os.fsync(self.fd)
+
+    def close(self):
+        self.fileobj.flush()
+        self.fileobj.close()
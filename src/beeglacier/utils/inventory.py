@@ -0,0 +1,169 @@
+import codecs
+import csv
+import json
+
+"""
+Streaming parsers for vault inventories.
+
+The job output is read in chunks and archives are yielded one by one,
+so memory stays bounded by the chunk size (plus one archive) however
+big the vault is. Archives come as dicts with the keys of the JSON
+ArchiveList (ArchiveId, ArchiveDescription, CreationDate, Size,
+SHA256TreeHash) for both formats.
+"""
+
+JSON = 'JSON'
+CSV = 'CSV'
+CHUNK_SIZE = 1024 * 1024
+ARCHIVE_LIST = 'ArchiveList'
+
+
+class InventoryError(Exception):
+    pass
+
+
+def format_of(content_type):
+    """ inventory format from the job output content type
+    """
+    if content_type and 'csv' in content_type.lower():
+        return CSV
+    return JSON
+
+
+def _text_chunks(body, chunk_size):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        data = body.read(chunk_size)
+        if not data:
+            break
+        yield decoder.decode(data)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _lines(body, chunk_size):
+    """ decoded lines with their line endings, as csv.reader wants them
+    """
+    pending = ''
+    for text in _text_chunks(body, chunk_size):
+        lines = (pending + text).split('\n')
+        # the last line may continue in the next chunk
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+
+def iter_csv(body, chunk_size=CHUNK_SIZE):
+    reader = csv.reader(_lines(body, chunk_size))
+    header = next(reader, None)
+    if header is None:
+        return
+    for values in reader:
+        if values:
+            yield dict(zip(header, values))
+
+
+class _JSONStream():
+    """ Pull tokenizer over a text stream: values are decoded one at a
+        time with JSONDecoder.raw_decode, more text is read only when a
+        value is cut at the end of the buffer.
+    """
+
+    WHITESPACE = ' \t\r\n'
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """ read one more chunk, False at the end of the stream
+        """
+        if self._eof:
+            return False
+        text = next(self._chunks, None)
+        if text is None:
+            self._eof = True
+            return False
+        # drop what was consumed so the buffer stays small
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """ next significant character, '' at the end of the stream
+        """
+        while True:
+            while self._pos < len(self._buffer) and \
+                  self._buffer[self._pos] in self.WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise InventoryError(f'expected {chars!r}, found {char!r}')
+        self._pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise InventoryError('truncated inventory')
+            # a number at the end of the buffer may go on in the next chunk
+            if end == len(self._buffer) and not self._eof and \
+               isinstance(value, (int, float)) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def iter_json(body, chunk_size=CHUNK_SIZE, header=None):
+    """ archives of a JSON inventory; other top level fields (VaultARN,
+        InventoryDate) are stored in header when given
+    """
+    stream = _JSONStream(_text_chunks(body, chunk_size))
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == ARCHIVE_LIST:
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.expect(',]') == ']':
+                        break
+        else:
+            value = stream.value()
+            if header is not None:
+                header[key] = value
+
+        if stream.expect(',}') == '}':
+            return
+
+
+def iter_archives(body, fmt=JSON, chunk_size=CHUNK_SIZE, header=None):
+    """ archives of an inventory job output body, in either format
+    """
+    if fmt == CSV:
+        return iter_csv(body, chunk_size)
+    return iter_json(body, chunk_size, header)
@@ -0,0 +1,77 @@
+import math
+import os
+
+"""
+Automatic part size selection.
+
+The part size is the smallest power of two MB that keeps the number of
+parts within Glacier's limit and keeps the fixed cost of every request
+below OVERHEAD_TARGET of the time spent moving its bytes, given the
+throughput of one connection. Uploads also cap it so that one part per
+worker fits in their memory budget; only the part limit goes above it.
+"""
+
+AUTO = 'auto'
+MB = 1024 * 1024
+MIN_PART_SIZE = 1        # MB
+MAX_PART_SIZE = 4096     # MB
+MAX_PARTS = 10000
+REQUEST_OVERHEAD = 0.25  # seconds lost per request (round trip, signing)
+OVERHEAD_TARGET = 0.05
+DEFAULT_THROUGHPUT = 2 * MB  # bytes per second per connection
+
+
+def choose_part_size(size, throughput=None, max_parts=MAX_PARTS,
+                     memory_budget=None, num_workers=None):
+    """ part size in MB for size bytes
+
+        :param throughput: measured bytes per second of one connection
+        :param max_parts: part count limit, None for no limit (downloads)
+        :param memory_budget: MB of part buffers in flight, with
+                              num_workers: parts are at most the largest
+                              power of two MB of memory_budget/num_workers
+    """
+    throughput = throughput or DEFAULT_THROUGHPUT
+
+    # request cost / (request cost + transfer time) <= target
+    needed = throughput * REQUEST_OVERHEAD * (1 - OVERHEAD_TARGET) \
+        / OVERHEAD_TARGET
+    # no need for parts bigger than the whole archive
+    needed = min(needed, size)
+    if memory_budget:
+        # a buffer for every worker, or the upload runs serially
+        per_worker = memory_budget / max(1, num_workers or 1)
+        needed = min(needed, align_part_size(per_worker) * MB)
+    if max_parts:
+        needed = max(needed, math.ceil(size / max_parts))
+
+    part_size = MIN_PART_SIZE
+    while part_size * MB < needed and part_size < MAX_PART_SIZE:
+        part_size *= 2
+    return part_size
+
+
+def align_part_size(part_size):
+    """ largest power of two MB not above part_size (MB), so parts and
+        ranges fall on tree hash boundaries
+    """
+    aligned = MIN_PART_SIZE
+    while aligned * 2 <= min(part_size, MAX_PART_SIZE):
+        aligned *= 2
+    return aligned
+
+
+def path_size(path):
+    """ bytes of a file, or of every file under a directory
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,159 @@
+import random
+import socket
+import threading
+import time
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectionError as BotoConnectionError,
+    HTTPClientError
+)
+
+"""
+Retries for part uploads and range downloads.
+
+Errors are classified as throttling, transient (network, timeouts,
+5xx) or checksum mismatches; anything else is fatal and raised at once.
+Waits use exponential backoff with full jitter and every operation has
+a budget of attempts and seconds. A throttling error closes the
+client's ThrottleGate for the backoff, so every worker of that client
+waits instead of piling more requests on.
+"""
+
+THROTTLE = 'throttle'
+TRANSIENT = 'transient'
+CHECKSUM = 'checksum'
+FATAL = 'fatal'
+
+MAX_ATTEMPTS = 10
+MAX_SECONDS = 15 * 60
+BACKOFF_BASE = {THROTTLE: 1.0, TRANSIENT: 0.5, CHECKSUM: 0.1}
+BACKOFF_CAP = 60.0
+POLL_INTERVAL = 0.5
+
+THROTTLING_CODES = [
+    'ThrottlingException', 'Throttling', 'RequestLimitExceeded',
+    'TooManyRequestsException', 'SlowDown'
+]
+TIMEOUT_CODES = ['RequestTimeoutException', 'RequestTimeout']
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class Interrupted(Exception):
+    """ the operation was stopped (paused or aborted) between attempts
+    """
+    pass
+
+
+def _error_code(error):
+    if isinstance(error, ClientError):
+        response = error.response
+        return (response.get('Error', {}).get('Code'),
+                response.get('ResponseMetadata', {}).get('HTTPStatusCode'))
+    return None, None
+
+
+def is_throttling(error):
+    code, status = _error_code(error)
+    return code in THROTTLING_CODES or status == 429
+
+
+def is_timeout(error):
+    code, _ = _error_code(error)
+    return code in TIMEOUT_CODES or \
+        isinstance(error, (socket.timeout, TimeoutError)) or \
+        'Timeout' in type(error).__name__
+
+
+def classify(error):
+    if isinstance(error, ChecksumMismatch):
+        return CHECKSUM
+    if is_throttling(error):
+        return THROTTLE
+    if is_timeout(error):
+        return TRANSIENT
+
+    code, status = _error_code(error)
+    if status is not None:
+        return TRANSIENT if status >= 500 else FATAL
+
+    if isinstance(error, (HTTPClientError, BotoConnectionError,
+                          ConnectionError)):
+        return TRANSIENT
+    return FATAL
+
+
+class ThrottleGate():
+    """ Shared pause for all the workers of one client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until = 0.0
+        self.events = 0
+
+    def close_for(self, seconds):
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+            self.events += 1
+
+    def remaining(self):
+        return max(0.0, self._until - time.monotonic())
+
+
+class Retrier():
+
+    def __init__(self, gate=None, max_attempts=MAX_ATTEMPTS,
+                 max_seconds=MAX_SECONDS):
+        self.gate = gate or ThrottleGate()
+        self.max_attempts = max_attempts
+        self.max_seconds = max_seconds
+
+    def backoff(self, attempt, kind):
+        """ full jitter: uniform between 0 and the exponential ceiling
+        """
+        ceiling = min(BACKOFF_CAP, BACKOFF_BASE[kind] * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def _sleep(self, seconds, should_stop):
+        deadline = time.monotonic() + seconds
+        while True:
+            if should_stop and should_stop():
+                raise Interrupted()
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            time.sleep(min(left, POLL_INTERVAL))
+
+    def call(self, fn, *args, should_stop=None, on_error=None, **kwargs):
+        """ run fn until it succeeds, an error is fatal or the budget
+            is spent; the last error is raised
+
+            :param should_stop: checked before every attempt and while
+                                waiting, raises Interrupted when true
+            :param on_error: called with (error, kind) for each failure
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            self._sleep(self.gate.remaining(), should_stop)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as error:
+                kind = classify(error)
+                if on_error:
+                    on_error(error, kind)
+
+                attempt += 1
+                delay = 0.0 if kind == FATAL else self.backoff(attempt, kind)
+                spent = time.monotonic() - started + delay
+                if kind == FATAL or attempt >= self.max_attempts or \
+                   spent > self.max_seconds:
+                    raise
+
+                if kind == THROTTLE:
+                    self.gate.close_for(delay)
+                self._sleep(delay, should_stop)
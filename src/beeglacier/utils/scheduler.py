@@ -0,0 +1,152 @@
+from collections import deque
+from concurrent.futures import Future
+import itertools
+import threading
+
+"""
+Process-wide part scheduler.
+
+Every upload submits its parts here instead of owning a thread pool,
+so the number of open connections is bounded by the worker count no
+matter how many uploads run. Free workers pick the next part from the
+upload with the highest priority; between uploads of the same priority
+the one with the fewest running parts goes first, so slots are shared
+fairly and a new upload starts as soon as any worker frees up.
+"""
+
+DEFAULT_WORKERS = 8
+
+
+class _UploadQueue():
+
+    def __init__(self, priority, order):
+        self.priority = priority
+        self.order = order
+        self.tasks = deque()
+        self.running = 0
+        self.served = 0
+
+
+class UploadScheduler():
+
+    def __init__(self, num_workers=DEFAULT_WORKERS):
+        self._cond = threading.Condition()
+        self._uploads = {}
+        self._order = itertools.count()
+        self._served = itertools.count()
+        self._workers = 0
+        self._target = 0
+        self.resize(num_workers)
+
+    @property
+    def num_workers(self):
+        return self._target
+
+    def resize(self, num_workers):
+        """ change the number of shared workers (the connection budget)
+        """
+        num_workers = max(1, num_workers)
+        with self._cond:
+            self._target = num_workers
+            while self._workers < self._target:
+                self._workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+            self._cond.notify_all()
+
+    def register(self, upload_id, priority=0):
+        """ add an upload, higher priority uploads are served first
+        """
+        with self._cond:
+            queue = self._uploads.get(upload_id)
+            if queue:
+                queue.priority = priority
+            else:
+                self._uploads[upload_id] = _UploadQueue(priority,
+                                                        next(self._order))
+
+    def set_priority(self, upload_id, priority):
+        with self._cond:
+            if upload_id in self._uploads:
+                self._uploads[upload_id].priority = priority
+
+    def unregister(self, upload_id):
+        """ forget an upload, its queued parts are cancelled
+        """
+        with self._cond:
+            queue = self._uploads.pop(upload_id, None)
+        if queue:
+            for future, _, _, _ in queue.tasks:
+                future.cancel()
+
+    def submit(self, upload_id, fn, *args, **kwargs):
+        future = Future()
+        with self._cond:
+            if upload_id not in self._uploads:
+                self._uploads[upload_id] = _UploadQueue(0, next(self._order))
+            self._uploads[upload_id].tasks.append((future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        """ queued and running parts per upload
+        """
+        with self._cond:
+            return {
+                upload_id: {
+                    'priority': queue.priority,
+                    'queued': len(queue.tasks),
+                    'running': queue.running
+                } for upload_id, queue in self._uploads.items()
+            }
+
+    def _next_task(self):
+        """ pick the next part; caller holds the lock
+        """
+        candidates = [q for q in self._uploads.values() if q.tasks]
+        if not candidates:
+            return None, None
+
+        queue = min(candidates, key=lambda q: (-q.priority, q.running,
+                                              q.served, q.order))
+        queue.running += 1
+        queue.served = next(self._served)
+        return queue, queue.tasks.popleft()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._workers > self._target:
+                        self._workers -= 1
+                        return
+                    queue, task = self._next_task()
+                    if task:
+                        break
+                    self._cond.wait()
+
+            future, fn, args, kwargs = task
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._cond:
+                    queue.running -= 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """ the scheduler shared by every Glacier instance
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = UploadScheduler()
+        return _scheduler
@@ -9,6 +9,7 @@ TEXT = {
     'LABEL_SELECTED_VAULT': 'Selected: %s',
     'LABEL_UPLOAD_VAULT': 'Upload to: %s',
     'LABEL_SELECTED_ARCHIVE': 'Selected Archive: %s',
+    'LABEL_ARCHIVES_COUNT': 'Archives: %d',
     'DIALOG_DELETE': "Do you want to delete '%s' ",
     'ERROR_DELETE_VAULT_FILES': 'Cannot delete a vault with archives inside',
     'ERROR_NOT_SELECTED_VAULT': 'Vault not selected',
@@ -0,0 +1,242 @@
+from collections import deque
+import itertools
+import threading
+import time
+import traceback
+
+"""
+Background task executor of the app.
+
+UI actions run here instead of on raw threads. Interactive tasks
+(refreshes, job checks, deletes) are served by a fixed pool of workers.
+Bulk tasks (uploads, downloads) only coordinate a transfer whose
+connections are already bounded by the upload scheduler and the
+connection gate, so each one starts at once on a thread of its own:
+a new transfer never waits for another to end, and never takes a worker
+from the interactive tasks.
+
+A task submitted while an identical one (same key) is still queued or
+running is not queued again, the running one is returned. Every task has
+a CancelToken: cancelling a queued task drops it, a running task sees
+its token through current_token() and stops at the next check. Done
+callbacks are handed to `dispatch`, which runs them on the UI loop.
+"""
+
+INTERACTIVE = 0
+BULK = 1
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+INTERACTIVE_WORKERS = 2
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancelToken():
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+
+_local = threading.local()
+
+
+def current_token():
+    """ token of the task running in this thread, None outside tasks
+    """
+    return getattr(_local, 'token', None)
+
+
+def cancelled():
+    """ True when the task running in this thread was cancelled
+    """
+    token = current_token()
+    return token is not None and token.cancelled
+
+
+class Task():
+
+    def __init__(self, task_id, fn, args, kwargs, priority, key, name):
+        self.id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.name = name
+        self.token = CancelToken()
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.callbacks = []
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled
+
+    def as_dict(self):
+        now = time.monotonic()
+        started = self.started_at or now
+        return {
+            'id': self.id,
+            'name': self.name,
+            'priority': 'bulk' if self.priority == BULK else 'interactive',
+            'state': self.state,
+            'waiting': started - self.queued_at,
+            'running': (self.finished_at or now) - started
+                       if self.started_at else 0.0
+        }
+
+
+def _task_key(fn, args, kwargs):
+    """ default key: the function and its arguments; None (never
+        de-duplicated) when the arguments are not hashable
+    """
+    key = (fn, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class TaskExecutor():
+
+    def __init__(self, num_workers=INTERACTIVE_WORKERS, dispatch=None):
+        """ :param num_workers: workers for the interactive tasks
+            :param dispatch: dispatch(callback) runs callback() on the UI
+                             loop; callbacks run in the worker without it
+        """
+        self.num_workers = max(1, num_workers)
+        self._dispatch = dispatch
+        self._cond = threading.Condition()
+        self._queue = deque()         # interactive tasks waiting
+        self._running = {}            # id -> task
+        self._active = {}             # key -> queued or running task
+        self._ids = itertools.count(1)
+        for _ in range(self.num_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, fn, *args, priority=INTERACTIVE, key=None, name=None,
+               on_done=None, **kwargs):
+        """ queue fn(*args, **kwargs), returns its Task. An identical task
+            still queued or running is returned instead of a new one;
+            on_done(task) is called when it ends, whatever the outcome
+        """
+        if key is None:
+            key = _task_key(fn, args, kwargs)
+        with self._cond:
+            task = self._active.get(key) if key is not None else None
+            if task is None or task.cancelled:
+                task = Task(next(self._ids), fn, args, kwargs, priority, key,
+                            name or getattr(fn, '__name__', repr(fn)))
+                if key is not None:
+                    self._active[key] = task
+                if priority == BULK:
+                    self._start(task)
+                    threading.Thread(target=self._run, args=(task,),
+                                     daemon=True).start()
+                else:
+                    self._queue.append(task)
+                    self._cond.notify()
+            if on_done:
+                task.callbacks.append(on_done)
+        return task
+
+    def cancel(self, task_or_key):
+        """ cancel a task (or the active task with that key); a queued
+            task is dropped, a running one is asked to stop.
+            Returns whether there was a task to cancel
+        """
+        with self._cond:
+            task = task_or_key
+            if not isinstance(task_or_key, Task):
+                task = self._active.get(task_or_key)
+            if task is None or task.state not in (QUEUED, RUNNING):
+                return False
+            task.token.cancel()
+            if task.state != QUEUED:
+                return True
+            self._queue.remove(task)
+        self._finish(task, CANCELLED)
+        return True
+
+    def snapshot(self):
+        """ queued and running tasks, in the order they are served
+        """
+        with self._cond:
+            queued = list(self._queue)
+            running = list(self._running.values())
+        return {
+            QUEUED: [task.as_dict() for task in queued],
+            RUNNING: [task.as_dict() for task in running]
+        }
+
+    def _start(self, task):
+        """ caller holds the lock
+        """
+        task.state = RUNNING
+        task.started_at = time.monotonic()
+        self._running[task.id] = task
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                task = self._queue.popleft()
+                self._start(task)
+            self._run(task)
+
+    def _run(self, task):
+        _local.token = task.token
+        state = FAILED
+        try:
+            task.result = task.fn(*task.args, **task.kwargs)
+            state = CANCELLED if task.cancelled else DONE
+        except TaskCancelled:
+            state = CANCELLED
+        except BaseException as e:
+            # SystemExit included: it must not end the worker
+            print(f'Task {task.name} failed: {e!r}')
+            traceback.print_exc()
+            task.error = e
+        finally:
+            _local.token = None
+            with self._cond:
+                del self._running[task.id]
+            self._finish(task, state)
+
+    def _finish(self, task, state):
+        with self._cond:
+            task.state = state
+            task.finished_at = time.monotonic()
+            if task.key is not None and self._active.get(task.key) is task:
+                del self._active[task.key]
+            callbacks, task.callbacks = task.callbacks, []
+
+        for callback in callbacks:
+            if self._dispatch:
+                self._dispatch(lambda callback=callback: callback(task))
+            else:
+                callback(task)
@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+import binascii
+import hashlib
+import mmap
+import os
+import threading
+
+"""
+SHA-256 tree hash as used by Glacier.
+
+Everything here works on raw 32-byte digests; hex strings only appear
+at the edges (to_hex / from_hex) where AWS expects or returns them.
+Part hashes of parts whose size is a power of two MB are subtrees of
+the archive tree, so combining them gives the archive tree hash.
+"""
+
+LEAF_SIZE = 1024 * 1024  # 1 MB
+REGION_SIZE = 64 * LEAF_SIZE  # unit of work when hashing files in parallel
+
+
+def to_hex(digest):
+    return binascii.hexlify(digest).decode()
+
+
+def from_hex(checksum):
+    return binascii.unhexlify(checksum)
+
+
+def leaf_digests(data):
+    """ sha256 digest of every 1 MB leaf of data, without copying it
+    """
+    view = memoryview(data)
+    return [hashlib.sha256(view[pos:pos + LEAF_SIZE]).digest()
+            for pos in range(0, len(view), LEAF_SIZE)]
+
+
+def combine(digests):
+    """ reduce a list of raw digests to the root of their tree
+    """
+    if not digests:
+        return hashlib.sha256(b'').digest()
+
+    tree = digests
+    while len(tree) > 1:
+        parent = [hashlib.sha256(tree[i] + tree[i + 1]).digest()
+                  for i in range(0, len(tree) - 1, 2)]
+        if len(tree) % 2:
+            parent.append(tree[-1])
+        tree = parent
+    return tree[0]
+
+
+def tree_hash(data, counter=None):
+    if counter is not None:
+        counter.add(len(data))
+    return combine(leaf_digests(data))
+
+
+def part_hashes(data, counter=None):
+    """ tree hash and linear sha256 of data in a single pass
+
+        Returns both as raw digests. Each leaf is fed to its leaf hash
+        and to the linear hash while it is hot in cache.
+    """
+    view = memoryview(data)
+    linear = hashlib.sha256()
+    leaves = []
+    for pos in range(0, len(view), LEAF_SIZE):
+        leaf = view[pos:pos + LEAF_SIZE]
+        leaves.append(hashlib.sha256(leaf).digest())
+        linear.update(leaf)
+
+    if counter is not None:
+        counter.add(len(view))
+
+    return combine(leaves), linear.digest()
+
+
+def reader_hashes(reader, size, counter=None):
+    """ part_hashes of the first size bytes read from a PartReader, one
+        leaf at a time, so the data is never held in memory at once
+    """
+    buffer = bytearray(LEAF_SIZE)
+    view = memoryview(buffer)
+    linear = hashlib.sha256()
+    leaves = []
+    for pos in range(0, size, LEAF_SIZE):
+        count = reader.readinto(pos, view[:min(LEAF_SIZE, size - pos)])
+        leaves.append(hashlib.sha256(view[:count]).digest())
+        linear.update(view[:count])
+
+    if counter is not None:
+        counter.add(size)
+
+    return combine(leaves), linear.digest()
+
+
+def hash_ranges(fileobj, ranges, workers=None, counter=None):
+    """ tree hash of each (offset, length) range of a file
+
+        Ranges are cut in leaf-aligned regions that are hashed on a
+        thread pool (sha256 releases the GIL) straight from a read-only
+        mmap, and their leaves are merged back in order. Returns raw
+        digests in the order of ranges.
+    """
+    fd = fileobj.fileno()
+    size = os.fstat(fd).st_size
+    if not size:
+        return [combine([]) for _ in ranges]
+
+    tasks = []
+    for index, (offset, length) in enumerate(ranges):
+        end = min(offset + length, size)
+        for start in range(offset, end, REGION_SIZE):
+            tasks.append((index, start, min(start + REGION_SIZE, end)))
+
+    file_map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+    def hash_region(task):
+        index, start, end = task
+        with memoryview(file_map) as view:
+            leaves = leaf_digests(view[start:end])
+        if counter is not None:
+            counter.add(end - start)
+        return index, leaves
+
+    leaves_by_range = [[] for _ in ranges]
+    try:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as ex:
+            for index, leaves in ex.map(hash_region, tasks):
+                leaves_by_range[index].extend(leaves)
+    finally:
+        file_map.close()
+
+    return [combine(leaves) for leaves in leaves_by_range]
+
+
+def hash_file(fileobj, workers=None, counter=None):
+    """ tree hash of a whole file, see hash_ranges
+    """
+    size = os.fstat(fileobj.fileno()).st_size
+    return hash_ranges(fileobj, [(0, size)], workers, counter)[0]
+
+
+class HashCounter():
+    """ Thread-safe count of bytes hashed, used to check that every
+        byte of an upload goes through sha256 only once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def add(self, nbytes):
+        with self._lock:
+            self.value += nbytes
+
+
+class TreeHash():
+    """ Streaming tree hash.
+
+        Data can be fed in chunks of any size; each 1 MB leaf is hashed
+        once, as soon as it is complete, and its digest is kept so part
+        and archive hashes can be built later without the data.
+    """
+
+    def __init__(self):
+        self.leaves = []
+        self._leaf = hashlib.sha256()
+        self._leaf_len = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view):
+            take = min(LEAF_SIZE - self._leaf_len, len(view) - pos)
+            self._leaf.update(view[pos:pos + take])
+            self._leaf_len += take
+            pos += take
+            if self._leaf_len == LEAF_SIZE:
+                self._close_leaf()
+
+    def _close_leaf(self):
+        self.leaves.append(self._leaf.digest())
+        self._leaf = hashlib.sha256()
+        self._leaf_len = 0
+
+    def flush(self):
+        """ close a trailing partial leaf, returns the list of leaves
+        """
+        if self._leaf_len:
+            self._close_leaf()
+        return self.leaves
+
+    def digest(self):
+        return combine(self.flush())
+
+    def hexdigest(self):
+        return to_hex(self.digest())
@@ -0,0 +1,129 @@
+import threading
+
+"""
+In-memory state of the uploads of one Glacier instance.
+
+Every upload has a record guarded by its own lock. Workers change it
+only through the store: plain updates, counter increments and
+conditional updates are each applied under that lock, so concurrent
+parts never lose an increment and a status transition is checked and
+made in one step. Readers get snapshots (plain dicts) instead of the
+live records.
+"""
+
+FIELDS = (
+    'vault', 'upload_id', 'path', 'description', 'status',
+    'total_parts', 'uploading', 'done', 'concurrency', 'throughput',
+    'hashed_bytes', 'last_response', 'error'
+)
+COUNTERS = ('total_parts', 'uploading', 'done', 'hashed_bytes')
+
+
+class UploadState():
+    """ State of one upload, see FIELDS
+    """
+    __slots__ = FIELDS + ('lock',)
+
+    def __init__(self, **fields):
+        self.lock = threading.Lock()
+        for name in FIELDS:
+            setattr(self, name, 0 if name in COUNTERS else None)
+        self._set(fields)
+
+    def _set(self, fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def as_dict(self):
+        """ copy of the fields that are set
+        """
+        return {name: getattr(self, name) for name in FIELDS
+                if getattr(self, name) is not None}
+
+
+class UploadStateStore():
+
+    def __init__(self, on_change=None):
+        """ :param on_change: called with the upload id after every change
+        """
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._on_change = on_change
+
+    def _changed(self, upload_id):
+        if self._on_change:
+            self._on_change(upload_id)
+
+    def __contains__(self, upload_id):
+        return upload_id in self._uploads
+
+    def create(self, upload_id, **fields):
+        """ start (or replace) the record of an upload
+        """
+        record = UploadState(upload_id=upload_id, **fields)
+        with self._lock:
+            self._uploads[upload_id] = record
+        self._changed(upload_id)
+
+    def remove(self, upload_id):
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+        self._changed(upload_id)
+
+    def get(self, upload_id, name, default=None):
+        record = self._uploads.get(upload_id)
+        if record is None:
+            return default
+        return getattr(record, name)
+
+    def update(self, upload_id, **fields):
+        """ set fields of an upload; unknown (removed) uploads are
+            ignored, returns whether the record exists
+        """
+        return self.update_if(upload_id, None, **fields)
+
+    def update_if(self, upload_id, condition, **fields):
+        """ set fields only if condition(record) holds, checked under the
+            record's lock; returns whether they were set
+        """
+        record = self._uploads.get(upload_id)
+        if record is None:
+            return False
+        with record.lock:
+            if condition is not None and not condition(record):
+                return False
+            record._set(fields)
+        self._changed(upload_id)
+        return True
+
+    def add(self, upload_id, **deltas):
+        """ increment counters atomically, returns the new values
+        """
+        record = self._uploads.get(upload_id)
+        if record is None:
+            return None
+        with record.lock:
+            for name, delta in deltas.items():
+                setattr(record, name, getattr(record, name) + delta)
+            values = {name: getattr(record, name) for name in deltas}
+        self._changed(upload_id)
+        return values
+
+    def snapshot(self, upload_id=None):
+        """ {upload_id: fields} of every upload, or the fields of one;
+            each record is copied under its lock, so it is consistent
+        """
+        if upload_id is not None:
+            record = self._uploads.get(upload_id)
+            if record is None:
+                return None
+            with record.lock:
+                return record.as_dict()
+
+        with self._lock:
+            records = list(self._uploads.items())
+        snapshot = {}
+        for upload_id, record in records:
+            with record.lock:
+                snapshot[upload_id] = record.as_dict()
+        return snapshot
@@ -0,0 +1,33 @@
+from beeglacier.utils.partsize import MB, MAX_PARTS, choose_part_size
+
+GB = 1024 * MB
+FAST = 30 * MB  # bytes per second per connection
+
+
+def test_fast_link_picks_large_parts_without_budget():
+    assert choose_part_size(100 * GB, FAST) >= 256
+
+
+def test_part_size_capped_by_memory_budget_per_worker():
+    # 256 MB over 8 workers: 32 MB parts, one buffer per worker
+    assert choose_part_size(100 * GB, FAST, memory_budget=256,
+                            num_workers=8) == 32
+
+
+def test_cap_rounds_down_to_a_power_of_two():
+    assert choose_part_size(100 * GB, FAST, memory_budget=256,
+                            num_workers=6) == 32
+
+
+def test_part_limit_is_the_floor_over_the_cap():
+    # 1 TB in 10,000 parts needs at least 128 MB parts
+    size = 1024 * GB
+    part_size = choose_part_size(size, FAST, memory_budget=256,
+                                 num_workers=8)
+    assert part_size == 128
+    assert part_size * MB * MAX_PARTS >= size
+
+
+def test_small_archive_keeps_small_parts():
+    assert choose_part_size(3 * MB, FAST, memory_budget=256,
+                            num_workers=8) == 4